@@ -21,7 +21,14 @@ and SQL database
 import sys
 from flask import Flask
 from service import config
-from service.common import log_handlers
+from service.common import (
+    cart_cache,
+    compression,
+    filter_cache,
+    log_handlers,
+    msgpack_codec,
+    read_cache,
+)
 
 
 ############################################################
@@ -37,6 +44,11 @@ def create_app():
     # pylint: disable=import-outside-toplevel
     from service.models import db
     db.init_app(app)
+    read_cache.init_app(app)
+    cart_cache.init_app(app)
+    filter_cache.init_app(app)
+    compression.init_app(app)
+    msgpack_codec.init_app(app)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
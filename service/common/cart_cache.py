@@ -0,0 +1,154 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cart Cache
+
+This module keeps the serialized carts of recently read users in a
+bounded, thread-safe LRU so repeated reads of a cart skip the database.
+Entries are dropped whenever a cart changes, can expire after a TTL, and
+the least recently used carts are evicted once the cache holds more than
+its byte budget.
+
+The cache lives in the worker process. Every process (and every replica)
+keeps its own copy, so writes made by one process only invalidate that
+process's entries; use a TTL when running more than one.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("flask.app")
+
+
+class CartCache:
+    """A size-bounded LRU of serialized carts keyed by user_id"""
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=None, enabled=True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (cart, size, expires_at)
+        self._bytes = 0
+        # Bumped by every invalidation so loads that raced a write are not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def configure(self, max_bytes, ttl, enabled):
+        """Applies new settings and empties the cache"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            self.enabled = enabled
+        self.clear()
+
+    def get_or_load(self, user_id, loader):
+        """Returns the cached cart of a user, calling loader() on a miss
+
+        The cart returned is shared with other requests and must not be
+        modified.
+        """
+        if not self.enabled:
+            return loader()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._remove(user_id)
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        cart = loader()
+        self._store(user_id, cart, generation)
+        return cart
+
+    def _store(self, user_id, cart, generation):
+        size = len(json.dumps(cart, default=str))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if generation != self._generation:
+                return  # the cart may have changed while it was loading
+            if user_id in self._entries:
+                self._remove(user_id)
+            self._entries[user_id] = (cart, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                logger.debug("Evicted cart of user_id %s from the cache", evicted)
+
+    def _remove(self, user_id):
+        _, size, _ = self._entries.pop(user_id)
+        self._bytes -= size
+
+    def invalidate(self, *user_ids):
+        """Drops the carts of the given users"""
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                if user_id in self._entries:
+                    self._remove(user_id)
+
+    def clear(self):
+        """Drops every cart and resets the counters"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        """Returns a dictionary with the cache usage and counters"""
+        with self._lock:
+            reads = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / reads if reads else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# The cache shared by every thread of this process
+cache = CartCache()
+
+
+def init_app(app):
+    """Configures the cache from the application settings"""
+    cache.configure(
+        max_bytes=app.config["CART_CACHE_MAX_BYTES"],
+        ttl=app.config["CART_CACHE_TTL"] or None,
+        enabled=app.config["CART_CACHE_ENABLED"],
+    )
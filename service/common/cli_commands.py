@@ -17,7 +17,8 @@
 Flask CLI Command Extensions
 """
 from flask import current_app as app  # Import Flask application
-from service.models import db
+from service.models import db, Shopcart, RETIRED_INDEXES, TRIGRAM_INDEX
+from service.common.migrations import create_indexes, create_trigram_index, drop_indexes
 
 
 ######################################################################
@@ -34,3 +35,25 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to build new indexes on an existing database
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Creates any missing tables and builds their indexes online with
+    CREATE INDEX CONCURRENTLY, along with the trigram index of description
+    searches when pg_trgm can be installed, then drops the indexes they
+    replace. Safe to run against production.
+    """
+    db.create_all()
+    for name in create_indexes(db.engine, Shopcart.__table__):
+        app.logger.info("Index %s is in place", name)
+    if create_trigram_index(db.engine, Shopcart.__tablename__, "description", TRIGRAM_INDEX):
+        app.logger.info("Index %s is in place", TRIGRAM_INDEX)
+    for name in drop_indexes(db.engine, RETIRED_INDEXES):
+        app.logger.info("Index %s was dropped", name)
@@ -0,0 +1,253 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Response Compression
+
+This module compresses JSON and text responses for clients that accept
+it. gzip is always offered; zstd and brotli are offered, and preferred,
+when the zstandard and brotli packages are installed. Bodies smaller than
+COMPRESS_MIN_SIZE are sent as they are.
+
+Streamed responses are compressed chunk by chunk and flushed after each
+chunk, so every NDJSON line still reaches the client as soon as it is
+produced. The bytes saved and the time spent compressing are counted per
+encoding for the /metrics endpoint.
+"""
+import logging
+import threading
+import time
+import zlib
+from flask import request
+
+logger = logging.getLogger("flask.app")
+
+# Media types worth compressing; anything under text/ is compressed too
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "application/msgpack")
+
+
+class GzipEncoder:
+    """Incremental gzip compression"""
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        """Compresses a chunk, possibly keeping some of it buffered"""
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Returns everything compressed so far, keeping the stream open"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.flush()
+
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+class ZstdEncoder:  # pragma: no cover
+    """Incremental zstd compression"""
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        """Compresses a chunk, possibly keeping some of it buffered"""
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Returns everything compressed so far, keeping the stream open"""
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.flush()
+
+
+class BrotliEncoder:  # pragma: no cover
+    """Incremental brotli compression"""
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        """Compresses a chunk, possibly keeping some of it buffered"""
+        return self._compressor.process(data)
+
+    def flush(self):
+        """Returns everything compressed so far, keeping the stream open"""
+        return self._compressor.flush()
+
+    def finish(self):
+        """Ends the stream"""
+        return self._compressor.finish()
+
+
+# The available encoders by Content-Encoding, in order of preference, with
+# the configuration keys of their levels
+ENCODERS = {
+    name: encoder
+    for name, encoder, available in (
+        ("zstd", (ZstdEncoder, "COMPRESS_ZSTD_LEVEL"), zstandard is not None),
+        ("br", (BrotliEncoder, "COMPRESS_BROTLI_LEVEL"), brotli is not None),
+        ("gzip", (GzipEncoder, "COMPRESS_LEVEL"), True),
+    )
+    if available
+}
+
+
+class CompressionStats:
+    """Counts the responses compressed and the cost of compressing them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.skipped_small = 0
+        self.encodings = {}
+
+    def record(self, encoding, bytes_in, bytes_out, seconds):
+        """Adds one compressed response"""
+        with self._lock:
+            counters = self.encodings.setdefault(
+                encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+            )
+            counters["responses"] += 1
+            counters["bytes_in"] += bytes_in
+            counters["bytes_out"] += bytes_out
+            counters["seconds"] += seconds
+
+    def skip_small(self):
+        """Counts a response left uncompressed because of its size"""
+        with self._lock:
+            self.skipped_small += 1
+
+    def clear(self):
+        """Resets the counters"""
+        with self._lock:
+            self.skipped_small = 0
+            self.encodings = {}
+
+    def stats(self):
+        """Returns a dictionary with the counters of each encoding"""
+        with self._lock:
+            encodings = {}
+            for encoding, counters in self.encodings.items():
+                responses = counters["responses"]
+                encodings[encoding] = {
+                    "responses": responses,
+                    "bytes_in": counters["bytes_in"],
+                    "bytes_out": counters["bytes_out"],
+                    "ratio": counters["bytes_out"] / counters["bytes_in"]
+                    if counters["bytes_in"]
+                    else 0.0,
+                    "compress_time_total": counters["seconds"],
+                    "compress_time_avg": counters["seconds"] / responses,
+                }
+            return {"skipped_small": self.skipped_small, "encodings": encodings}
+
+
+# The counters shared by every thread of this process
+metrics = CompressionStats()
+
+
+def _compressible(response):
+    """Tells whether a response is a candidate for compression at all"""
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return False
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return False
+    if "no-transform" in response.headers.get("Cache-Control", ""):
+        return False
+    mimetype = response.mimetype or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+
+def _compress_stream(chunks, encoding, encoder):
+    """Compresses the chunks of a streamed body, flushing after each one"""
+    bytes_in = bytes_out = 0
+    seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            start = time.perf_counter()
+            data = encoder.compress(chunk) + encoder.flush()
+            seconds += time.perf_counter() - start
+            bytes_in += len(chunk)
+            bytes_out += len(data)
+            yield data
+        data = encoder.finish()
+        bytes_out += len(data)
+        yield data
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        metrics.record(encoding, bytes_in, bytes_out, seconds)
+
+
+def compress_response(response, config):
+    """Compresses a response with the best encoding the client accepts"""
+    if not _compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(list(ENCODERS))
+    if encoding is None:
+        return response
+    encoder_class, level_key = ENCODERS[encoding]
+    encoder = encoder_class(config[level_key])
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, encoder)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            metrics.skip_small()
+            return response
+        start = time.perf_counter()
+        compressed = encoder.compress(data) + encoder.finish()
+        took = time.perf_counter() - start
+        metrics.record(encoding, len(data), len(compressed), took)
+        logger.debug(
+            "Compressed %d bytes to %d with %s in %.2f ms",
+            len(data),
+            len(compressed),
+            encoding,
+            took * 1000,
+        )
+        response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """Compresses the responses of the application when it is enabled"""
+
+    @app.after_request
+    def compress(response):
+        if not app.config["COMPRESS_ENABLED"]:
+            return response
+        return compress_response(response, app.config)
@@ -0,0 +1,48 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Fast JSON Responses
+
+This module encodes response data straight to bytes, for handlers whose
+data already has the shape of their Swagger model and so needs no
+marshalling. orjson is used when it is installed and the standard library
+json module otherwise.
+"""
+from flask import current_app
+
+try:
+    import orjson
+
+    def dumps(data) -> bytes:
+        """Encodes data as compact JSON"""
+        return orjson.dumps(data)
+
+except ImportError:  # pragma: no cover
+    import json
+
+    def dumps(data) -> bytes:
+        """Encodes data as compact JSON"""
+        return json.dumps(data, separators=(",", ":")).encode()
+
+
+def make_json_response(data, code=200, headers=None):
+    """Makes a Flask response with a JSON encoded body"""
+    response = current_app.response_class(
+        dumps(data) + b"\n", status=code, mimetype="application/json"
+    )
+    response.headers.extend(headers or {})
+    return response
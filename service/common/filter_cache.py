@@ -0,0 +1,113 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Filter Cache
+
+This module keeps compiled query-string filters and the statements built
+from them in a bounded, thread-safe LRU. A compiled filter is the shape of
+a filter (which fields, with which operators) together with its converted
+values; statements are built once per shape with bind parameters, so a
+repeated query skips converting its values and building its statement,
+and sends the same SQL text whatever its values are.
+
+Entries are keyed by (kind, ...) tuples, and the hits and misses are
+counted per kind for the /metrics endpoint.
+"""
+import threading
+from collections import OrderedDict
+
+
+class FilterCache:
+    """An LRU of compiled filters and filter statements"""
+
+    def __init__(self, max_entries=1024, enabled=True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {}
+        self.evictions = 0
+
+    def configure(self, max_entries, enabled):
+        """Applies new settings and empties the cache"""
+        with self._lock:
+            self.max_entries = max_entries
+            self.enabled = enabled
+        self.clear()
+
+    def get_or_build(self, key, build):
+        """Returns the entry of a key, calling build() on a miss
+
+        The first item of the key names the kind of entry it is counted
+        under. Entries are shared between threads and must not be modified;
+        exceptions raised by build() are not cached.
+        """
+        if not self.enabled:
+            return build()
+        with self._lock:
+            counters = self._counters.setdefault(key[0], {"hits": 0, "misses": 0})
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                counters["hits"] += 1
+                return self._entries[key]
+            counters["misses"] += 1
+
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """Drops every entry and resets the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._counters = {}
+            self.evictions = 0
+
+    def stats(self):
+        """Returns a dictionary with the cache usage and the counters of each kind"""
+        with self._lock:
+            kinds = {}
+            for kind, counters in self._counters.items():
+                reads = counters["hits"] + counters["misses"]
+                kinds[kind] = {
+                    "hits": counters["hits"],
+                    "misses": counters["misses"],
+                    "hit_ratio": counters["hits"] / reads if reads else 0.0,
+                }
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "kinds": kinds,
+            }
+
+
+# The cache shared by every thread of this process
+cache = FilterCache()
+
+
+def init_app(app):
+    """Configures the cache from the application settings"""
+    cache.configure(
+        max_entries=app.config["FILTER_CACHE_SIZE"],
+        enabled=app.config["FILTER_CACHE_ENABLED"],
+    )
@@ -2,8 +2,22 @@
 Helper functions for services
 """
 
-from service.common import status
-from service.models import Shopcart
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from service.common import cart_cache, status
+from service.models import Shopcart, EXACT_MATCH_FIELDS, ITEM_FIELDS, SORT_FIELDS, STATS_GROUPS
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# The ?format= value that lists a page as one array per column
+COLUMNAR_FORMAT = "columnar"
+
+# Shortest text ?q= searches for; a shorter one has no trigram to look up in
+# the index, so it would scan every description
+SEARCH_MIN_LENGTH = 3
 
 
 def validate_request_data(data):
@@ -48,33 +62,41 @@ def update_or_create_cart_item(user_id, product_data):
     """Update an existing cart item or create a new one."""
     product_id = product_data["product_id"]
     quantity = product_data["quantity"]
-    name = product_data["name"]
-    price = product_data["price"]
     stock = product_data["stock"]
     purchase_limit = product_data["purchase_limit"]
-    cart_item = Shopcart.find(user_id, product_id)
 
-    if cart_item:
-        new_quantity = cart_item.quantity + quantity
-
-        # Validate against stock and purchase limits
+    # The combined quantity may not exceed the stock or the purchase limit
+    limits = [limit for limit in (stock, purchase_limit) if limit is not None]
+    cart = Shopcart(
+        user_id=user_id,
+        item_id=product_id,
+        description=product_data["name"],
+        quantity=quantity,
+        price=product_data["price"],
+    ).upsert(max_quantity=min(limits) if limits else None)
+
+    if cart is None:
+        existing = Shopcart.find(user_id, product_id)
+        new_quantity = quantity + (existing.quantity if existing else 0)
         error_response = validate_stock_and_limits(new_quantity, stock, purchase_limit)
         if error_response:
-            raise ValueError(error_response[0].json["error"])  # Extract error message
-
-        cart_item.quantity = new_quantity
-        cart_item.update()
-    else:
-        new_item = Shopcart(
-            user_id=user_id,
-            item_id=product_id,
-            description=name,
-            quantity=quantity,
-            price=price,
-        )
-        new_item.create()
+            raise ValueError(error_response[0])
+        raise ValueError(f"Cannot add {quantity} units of item {product_id}")
 
-    return Shopcart.find_by_user_id(user_id)
+    return cart
+
+
+def load_serialized_cart(user_id):
+    """Return the serialized items of a user's cart, cached when possible.
+
+    The list is shared through the cart cache and must not be modified.
+    """
+    return cart_cache.cache.get_or_load(
+        user_id,
+        lambda: [
+            Shopcart.serialize_row(row) for row in Shopcart.find_rows_by_user_id(user_id)
+        ],
+    )
 
 
 def validate_items_list(data):
@@ -87,29 +109,24 @@ def validate_items_list(data):
 
 def process_cart_updates(user_id, items):
     """Update or remove items in the user's shopping cart."""
+    quantities = {}
     for item in items:
         try:
             item_id = int(item["item_id"])
             quantity = int(item["quantity"])
         except (KeyError, ValueError, TypeError) as e:
             raise ValueError(f"Invalid input: {e}") from e
+        if item_id in quantities:
+            raise ValueError(f"Invalid input: item {item_id} is listed more than once")
+        quantities[item_id] = quantity
 
-        # Attempt to update/remove the cart item
-        update_cart_item_helper(user_id, item_id, quantity)
-
+    # Every item must exist before anything is changed
+    found = Shopcart.find_item_ids(user_id, list(quantities))
+    for item_id in quantities:
+        if item_id not in found:
+            raise LookupError(f"Item {item_id} not found in user {user_id}'s cart")
 
-def update_cart_item_helper(user_id, item_id, quantity):
-    """Update or remove a cart item based on the given quantity."""
-    cart_item = Shopcart.find(user_id, item_id)
-    if not cart_item:
-        # Raise an exception if the item does not exist
-        raise LookupError(f"Item {item_id} not found in user {user_id}'s cart")
-
-    if quantity == 0:
-        cart_item.delete()
-    else:
-        cart_item.quantity = quantity
-        cart_item.update()
+    Shopcart.update_quantities(user_id, quantities)
 
 
 def parse_operator_value(value_string):
@@ -158,9 +175,22 @@ def extract_item_filters(request_args):
         apply_price_bounds_filter(request_args, filters)
     except ValueError as e:
         raise ValueError(f"Error in price filters: {str(e)}")
+    apply_search_filter(request_args, filters)
     return filters
 
 
+def apply_search_filter(request_args, filters):
+    """Apply the q search, which finds a text anywhere in the description."""
+    if "q" not in request_args:
+        return
+    if "description" in filters:
+        raise ValueError("Cannot use both 'description' and 'q' in the same request.")
+    query = request_args["q"].strip()
+    if len(query) < SEARCH_MIN_LENGTH:
+        raise ValueError(f"q must be at least {SEARCH_MIN_LENGTH} characters long")
+    filters["description"] = {"operator": "contains", "value": query}
+
+
 def apply_price_bounds_filter(request_args, filters):
     """Apply min-price / max-price filters, but raise if price already handled."""
 
@@ -189,7 +219,13 @@ def apply_field_filter(field, request_args, filters):
     """Apply a filter for a single field to the filters dict."""
     range_key = f"{field}_range"
 
-    if range_key in request_args:
+    if field in EXACT_MATCH_FIELDS:
+        if range_key in request_args:
+            raise ValueError(f"{field} only supports exact matches")
+        if field in request_args:
+            filters[field] = {"operator": "eq", "value": request_args[field]}
+
+    elif range_key in request_args:
         value_string = request_args[range_key]
         try:
             start, end = map(str.strip, value_string.split(","))
@@ -211,3 +247,111 @@ def apply_field_filter(field, request_args, filters):
                 filters[field] = {"operator": operator, "value": value}
             except ValueError as e:
                 raise ValueError(f"Error parsing filter for {field}: {str(e)}")
+
+
+def parse_page_size(value, default, maximum):
+    """Parse the 'limit' query parameter into a page size."""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid limit: {value}") from e
+    if not 1 <= limit <= maximum:
+        raise ValueError(f"limit must be between 1 and {maximum}")
+    return limit
+
+
+def parse_fields(value, allowed=ITEM_FIELDS):
+    """Parse the 'fields' query parameter into a tuple of item field names.
+
+    The names come back in the order of allowed, without duplicates, or
+    None when the parameter is missing.
+    """
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(",")} - {""}
+    unknown = names.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not names:
+        raise ValueError("fields must name at least one field")
+    return tuple(name for name in allowed if name in names)
+
+
+def parse_format(value):
+    """Parse the 'format' query parameter, which only knows 'columnar'."""
+    if value is not None and value != COLUMNAR_FORMAT:
+        raise ValueError(f"Unknown format: {value}")
+    return value
+
+
+def decode_columnar(page):
+    """Turn a ?format=columnar page back into a list of item dictionaries.
+
+    This is the reference client decoder. data[i] holds the values of
+    columns[i], one per item, so item n is made of the n-th value of every
+    column.
+    """
+    return [dict(zip(page["columns"], values)) for values in zip(*page["data"])]
+
+
+def parse_sort(value):
+    """Parse the 'sort' query parameter into (field, descending) pairs.
+
+    Fields are separated by commas and sort in descending order when they
+    start with '-', e.g. price,-last_updated. Returns None when the
+    parameter is missing.
+    """
+    if value is None:
+        return None
+    sort = []
+    for name in (name.strip() for name in value.split(",")):
+        field = name.removeprefix("-")
+        if field not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort by '{name}'; use one of {', '.join(SORT_FIELDS)}")
+        if any(field == other for other, _ in sort):
+            raise ValueError(f"Cannot sort by {field} twice")
+        sort.append((field, name.startswith("-")))
+    return tuple(sort)
+
+
+def parse_group_by(value):
+    """Parse the 'group_by' query parameter of the stats endpoint.
+
+    Statistics are grouped by user_id, or by the day, week or month the
+    items were created in. Returns None when the parameter is missing.
+    """
+    if value is not None and value not in STATS_GROUPS:
+        raise ValueError(f"Cannot group by '{value}'; use one of {', '.join(STATS_GROUPS)}")
+    return value
+
+
+# Parsers of the cursor values of each sort field; the others are integers
+CURSOR_PARSERS = {
+    "price": Decimal,
+    "created_at": datetime.fromisoformat,
+    "last_updated": datetime.fromisoformat,
+}
+
+
+def encode_cursor(key):
+    """Encode the sort key of an item as an opaque page cursor."""
+    return base64.urlsafe_b64encode(json.dumps(list(key), default=str).encode()).decode()
+
+
+def decode_cursor(cursor, sort=None):
+    """Decode a page cursor made by encode_cursor back into its key.
+
+    The cursor must come from a page listed with the same sort.
+    """
+    fields = [field for field, _ in Shopcart.sort_key(sort)]
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(key, list) or len(key) != len(fields):
+            raise ValueError("wrong number of values")
+        return tuple(
+            CURSOR_PARSERS.get(field, int)(part) for field, part in zip(fields, key)
+        )
+    except (binascii.Error, UnicodeError, TypeError, ValueError, InvalidOperation) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
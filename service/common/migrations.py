@@ -0,0 +1,111 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Online Schema Migrations
+
+db.create_all() only creates missing tables, so indexes added to a model
+never reach an existing table. This module builds them online with
+CREATE INDEX CONCURRENTLY, and drops the indexes they replace with DROP
+INDEX CONCURRENTLY; neither blocks writes, and neither can run inside a
+transaction.
+
+The trigram index of description searches needs the pg_trgm extension,
+so it is not declared on the model; create_trigram_index() installs the
+extension when it can and builds the index only then.
+"""
+import logging
+import re
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+
+logger = logging.getLogger("flask.app")
+
+INVALID_INDEXES = text(
+    "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+    "WHERE NOT i.indisvalid AND c.relname = ANY(:names)"
+)
+
+EXISTING_INDEXES = text(
+    "SELECT c.relname FROM pg_class c WHERE c.relkind = 'i' AND c.relname = ANY(:names)"
+)
+
+
+def concurrent_index_ddl(index, dialect):
+    """Returns the CREATE INDEX CONCURRENTLY IF NOT EXISTS statement for an index"""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+    return re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)
+
+
+def create_indexes(engine, table):
+    """
+    Builds every index declared on a table without locking out writes
+
+    Indexes left invalid by an interrupted concurrent build are dropped and
+    rebuilt. Returns the names of the indexes that were processed.
+    """
+    names = [index.name for index in table.indexes]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in conn.execute(INVALID_INDEXES, {"names": names}).scalars():
+            logger.warning("Dropping invalid index %s", name)
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            logger.info("Building index %s", index.name)
+            conn.execute(text(concurrent_index_ddl(index, engine.dialect)))
+    return sorted(names)
+
+
+def drop_indexes(engine, names):
+    """
+    Drops indexes that are no longer declared, without locking out writes
+
+    Returns the names of the indexes that existed and were dropped.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        existing = conn.execute(EXISTING_INDEXES, {"names": list(names)}).scalars().all()
+        for name in sorted(existing):
+            logger.info("Dropping retired index %s", name)
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+    return sorted(existing)
+
+
+def create_trigram_index(engine, table, column, name):
+    """
+    Builds a GIN trigram index on a text column without locking out writes
+
+    pg_trgm is installed first when it is missing. Returns False, leaving
+    searches to scan the table, when the extension cannot be installed.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        except DBAPIError as error:
+            logger.warning("Cannot install pg_trgm, %s is not built: %s", name, error.orig)
+            return False
+
+        for invalid in conn.execute(INVALID_INDEXES, {"names": [name]}).scalars():
+            logger.warning("Dropping invalid index %s", invalid)
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{invalid}"'))
+        logger.info("Building index %s", name)
+        conn.execute(
+            text(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+                f'ON "{table}" USING gin ("{column}" gin_trgm_ops)'
+            )
+        )
+    return True
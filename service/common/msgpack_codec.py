@@ -0,0 +1,118 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+MessagePack Support
+
+This module lets clients exchange MessagePack instead of JSON. Responses
+are encoded as MessagePack for requests that prefer application/msgpack,
+and application/msgpack request bodies are decoded by request.get_json(),
+so the controllers read them like JSON. Timestamps are sent as MessagePack
+timestamps in UTC and prices as floats, so clients parse no strings.
+
+The msgpack package is optional; without it the service only speaks JSON.
+"""
+from datetime import datetime
+from flask import Request, make_response
+from werkzeug.exceptions import BadRequest
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# Serialized fields holding ISO 8601 timestamps
+TIMESTAMP_FIELDS = ("created_at", "last_updated")
+
+
+def available():
+    """Tells whether the msgpack package is installed"""
+    return msgpack is not None
+
+
+def _timestamp(text):
+    """Parses an ISO 8601 timestamp, reading one without a zone as UTC"""
+    if text[-6] not in "+-" and text[-1] != "Z":
+        # Timestamps are stored without a zone and are in UTC
+        text += "+00:00"
+    return datetime.fromisoformat(text)
+
+
+def _native(value):
+    """Turns the timestamp strings of serialized carts into datetimes
+
+    Only the timestamp fields, the items of a cart and the timestamp
+    columns of a columnar page are looked at, which keeps this well under
+    the cost of walking every value of every item.
+    """
+    if isinstance(value, list):
+        return [_native(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    native = dict(value)
+    for key in TIMESTAMP_FIELDS:
+        item = native.get(key)
+        if isinstance(item, str):
+            native[key] = _timestamp(item)
+    items = native.get("items")
+    if isinstance(items, list):
+        native["items"] = _native(items)
+    if "columns" in native and "data" in native:
+        # A ?format=columnar page holds one array of values per field
+        native["data"] = [
+            [_timestamp(item) for item in values] if name in TIMESTAMP_FIELDS else values
+            for name, values in zip(native["columns"], native["data"])
+        ]
+    return native
+
+
+def dumps(data) -> bytes:
+    """Encodes response data as MessagePack"""
+    return msgpack.packb(_native(data), datetime=True)
+
+
+def loads(data):
+    """Decodes a MessagePack body, with timestamps as aware datetimes"""
+    return msgpack.unpackb(data, timestamp=3)
+
+
+def output_msgpack(data, code, headers=None):
+    """Makes a Flask response with a MessagePack encoded body"""
+    resp = make_response(dumps(data), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+class MsgpackRequest(Request):
+    """A request whose get_json() also decodes application/msgpack bodies"""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if self.mimetype != MSGPACK_MIMETYPE:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        try:
+            return loads(self.get_data(cache=cache))
+        except (ValueError, msgpack.UnpackException) as error:
+            if silent:
+                return None
+            raise BadRequest("Failed to decode MessagePack body") from error
+
+
+def init_app(app):
+    """Lets the application read MessagePack request bodies"""
+    if available():
+        app.request_class = MsgpackRequest
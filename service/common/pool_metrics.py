@@ -0,0 +1,115 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Connection Pool Metrics
+
+This module contains a QueuePool that records how long checkouts wait
+and how many of them time out, so pool exhaustion shows up in the
+/metrics endpoint and the logs before requests start hanging. Time spent
+opening new connections is counted separately from the queue wait.
+"""
+import logging
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("flask.app")
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that keeps checkout wait, timeout and connect counters"""
+
+    # Checkouts waiting longer than this many seconds are logged
+    slow_checkout_seconds = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.connects = 0
+        self.connect_time_total = 0.0
+        self._checkout_state = threading.local()
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            took = time.perf_counter() - start
+            # Let the running checkout leave this out of its queue wait
+            self._checkout_state.connect_time = (
+                getattr(self._checkout_state, "connect_time", 0.0) + took
+            )
+            with self._metrics_lock:
+                self.connects += 1
+                self.connect_time_total += took
+
+    def _do_get(self):
+        self._checkout_state.connect_time = 0.0
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._metrics_lock:
+                self.checkout_timeouts += 1
+            logger.warning(
+                "Connection pool exhausted: %d checked out, %d overflow",
+                self.checkedout(),
+                self.overflow(),
+            )
+            raise
+        finally:
+            waited = time.perf_counter() - start - self._checkout_state.connect_time
+            with self._metrics_lock:
+                self.checkouts += 1
+                self.checkout_wait_total += waited
+                self.checkout_wait_max = max(self.checkout_wait_max, waited)
+            if waited > self.slow_checkout_seconds:
+                logger.warning("Waited %.3fs for a database connection", waited)
+
+    def stats(self):
+        """Returns a dictionary with the current pool usage and counters"""
+        with self._metrics_lock:
+            checkouts = self.checkouts
+            connects = self.connects
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": self.overflow(),
+                "checkouts": checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_avg": (
+                    self.checkout_wait_total / checkouts if checkouts else 0.0
+                ),
+                "checkout_wait_max": self.checkout_wait_max,
+                "connects": connects,
+                "connect_time_avg": (
+                    self.connect_time_total / connects if connects else 0.0
+                ),
+            }
+
+
+def pool_stats(pool):
+    """Returns usage statistics for any SQLAlchemy pool"""
+    if isinstance(pool, InstrumentedQueuePool):
+        return pool.stats()
+    return {"status": pool.status()}
@@ -0,0 +1,112 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request-scoped Read Cache
+
+This module memoizes model reads for the duration of one request, so a
+request never runs the same query twice. Every write clears the cache.
+Outside of a request reads are not cached.
+"""
+import logging
+from functools import wraps
+from flask import g, has_request_context
+
+logger = logging.getLogger("flask.app")
+
+# Response header with the cache counters when READ_CACHE_DEBUG is set
+DEBUG_HEADER = "X-Read-Cache"
+
+
+class ReadCache:
+    """The reads made during one request, keyed by query shape"""
+
+    def __init__(self):
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+
+def _current():
+    """Returns the cache for the current request, or None outside one"""
+    if not has_request_context():
+        return None
+    if "read_cache" not in g:
+        g.read_cache = ReadCache()
+    return g.read_cache
+
+
+def _freeze(value):
+    """Turns lists, sets and dictionaries into hashable values"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    return value
+
+
+def memoize_read(func):
+    """Caches the result of a read classmethod for the rest of the request"""
+
+    @wraps(func)
+    def wrapper(cls, *args, **kwargs):
+        cache = _current()
+        if cache is None:
+            return func(cls, *args, **kwargs)
+        key = (cls.__name__, func.__name__, _freeze(args), _freeze(kwargs))
+        if key in cache.results:
+            cache.hits += 1
+            return cache.results[key]
+        cache.misses += 1
+        result = cache.results[key] = func(cls, *args, **kwargs)
+        return result
+
+    return wrapper
+
+
+def invalidate():
+    """Forgets every cached read, called whenever the data changes"""
+    cache = _current()
+    if cache is not None:
+        cache.results.clear()
+
+
+def stats():
+    """Returns the hit and miss counts for the current request"""
+    cache = _current()
+    if cache is None:
+        return {"hits": 0, "misses": 0}
+    return {"hits": cache.hits, "misses": cache.misses}
+
+
+def init_app(app):
+    """Reports the counters of each request and drops its cache afterwards"""
+
+    @app.after_request
+    def report_read_cache(response):
+        if "read_cache" in g:
+            counters = stats()
+            logger.debug("Read cache: %(hits)d hits, %(misses)d misses", counters)
+            if app.config.get("READ_CACHE_DEBUG"):
+                response.headers[DEBUG_HEADER] = "hits={hits}, misses={misses}".format(**counters)
+        return response
+
+    @app.teardown_request
+    def drop_read_cache(_exc):
+        # The application context, and g with it, can outlive the request
+        g.pop("read_cache", None)
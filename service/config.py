@@ -13,7 +13,54 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Configure the database connection pool
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1"),
+}
+
+# Page sizes for GET /api/shopcarts
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# Most items GET /api/shopcarts/search returns, and its default limit
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+# Most rows an unpaged collection read may return: the items of an
+# application/x-ndjson stream or the groups of /api/shopcarts/stats; larger
+# ones are rejected with 413 before they run. 0 turns the check off
+QUERY_ROW_BUDGET = int(os.getenv("QUERY_ROW_BUDGET", "100000"))
+# Rows fetched per round trip when streaming application/x-ndjson
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Send each request's read cache hits and misses in an X-Read-Cache header
+READ_CACHE_DEBUG = os.getenv("READ_CACHE_DEBUG", "false").lower() in ("true", "1")
+
+# In-process LRU cache of serialized carts (see service/common/cart_cache.py)
+CART_CACHE_ENABLED = os.getenv("CART_CACHE_ENABLED", "true").lower() in ("true", "1")
+CART_CACHE_MAX_BYTES = int(os.getenv("CART_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Seconds a cart may be served from the cache; 0 keeps it until it changes
+CART_CACHE_TTL = float(os.getenv("CART_CACHE_TTL", "0"))
+
+# In-process LRU of compiled filters and their statements (see
+# service/common/filter_cache.py)
+FILTER_CACHE_ENABLED = os.getenv("FILTER_CACHE_ENABLED", "true").lower() in ("true", "1")
+FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "1024"))
+
+# Encode responses straight to JSON (with orjson when installed) instead of
+# marshalling them through flask-restx
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("true", "1")
+
+# Compress JSON responses for clients that accept gzip (or br/zstd when the
+# brotli or zstandard packages are installed)
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() in ("true", "1")
+# Bodies smaller than this many bytes are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_LEVEL = int(os.getenv("COMPRESS_BROTLI_LEVEL", "4"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
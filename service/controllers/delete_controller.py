@@ -12,17 +12,10 @@ def delete_shopcart_controller(user_id):
     app.logger.info("Request to delete shopcart for user_id: %s", user_id)
 
     try:
-        # Find all items for this user
-        user_items = Shopcart.find_by_user_id(user_id)
+        # Delete every item in the shopcart with one statement
+        deleted = Shopcart.delete_by_user_id(user_id)
 
-        # Delete each item in the shopcart
-        for item in user_items:
-            app.logger.info(
-                "Deleting item %s from user %s's cart", item.item_id, user_id
-            )
-            item.delete()
-
-        app.logger.info("Shopcart for user %s deleted", user_id)
+        app.logger.info("Shopcart for user %s deleted (%d items)", user_id, deleted)
         return {}, status.HTTP_204_NO_CONTENT
 
     except Exception as e:  # pylint: disable=broad-except
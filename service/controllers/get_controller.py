@@ -2,43 +2,164 @@
 GET Controller logic for Shopcart Service
 """
 
+import json
+from itertools import groupby
+from operator import attrgetter
 from werkzeug.exceptions import HTTPException
-from flask import request
+from flask import request, stream_with_context
 from flask import current_app as app
-from service.models import Shopcart
+from service.models import Shopcart, ITEM_FIELDS, QueryTooLargeError
 from service.common import status, helpers
 
+# Fields left out of the item listing of GET /shopcarts/<user_id>/items
+TIMESTAMPS = ("created_at", "last_updated")
+
+# Fields the item listing can be narrowed to with ?fields=
+ITEM_LISTING_FIELDS = tuple(field for field in ITEM_FIELDS if field not in TIMESTAMPS)
+
 
 def get_shopcarts_controller():
-    """List all shopcarts grouped by user"""
+    """List one page of shopcarts grouped by user
+
+    Items are paged in (user_id, item_id) order, or in the order of the
+    'sort' query parameter, so a cart can continue on the next page. The
+    cursor for the next page is sent in the X-Next-Cursor header and passed
+    back in the 'next' query parameter, along with the same sort. The items can be
+    narrowed to some of their fields with the 'fields' query parameter.
+    With format=columnar the page is one array of values per field instead.
+    """
+    app.logger.info("Request to list shopcarts with filters")
+
+    try:
+        filters = helpers.extract_item_filters(request.args)
+        limit = helpers.parse_page_size(
+            request.args.get("limit"),
+            app.config["DEFAULT_PAGE_SIZE"],
+            app.config["MAX_PAGE_SIZE"],
+        )
+        sort = helpers.parse_sort(request.args.get("sort"))
+        cursor = request.args.get("next")
+        after = helpers.decode_cursor(cursor, sort) if cursor else None
+        fields = helpers.parse_fields(request.args.get("fields"))
+        if helpers.parse_format(request.args.get("format")):
+            shopcarts_list, next_key = Shopcart.find_column_page(
+                filters, limit=limit, after=after, fields=fields, sort=sort
+            )
+        else:
+            shopcarts_list, next_key = Shopcart.find_cart_page(
+                filters, limit=limit, after=after, fields=fields, sort=sort
+            )
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST, {}
+
+    headers = {}
+    if next_key is not None:
+        headers["X-Next-Cursor"] = helpers.encode_cursor(next_key)
+    return shopcarts_list, status.HTTP_200_OK, headers
+
+
+def search_shopcarts_controller():
+    """Search the item descriptions for the 'q' query parameter
+
+    The other filters apply too. At most 'limit' items are returned, up to
+    SEARCH_MAX_RESULTS, with the best matches first.
+    """
+    app.logger.info("Request to search shopcart items")
+
+    try:
+        filters = helpers.extract_item_filters(request.args)
+        search = filters.pop("description", None)
+        if search is None or search["operator"] != "contains":
+            raise ValueError("q is required to search")
+        limit = helpers.parse_page_size(
+            request.args.get("limit"),
+            app.config["SEARCH_MAX_RESULTS"],
+            app.config["SEARCH_MAX_RESULTS"],
+        )
+        fields = helpers.parse_fields(request.args.get("fields"))
+        rows = Shopcart.search_descriptions(
+            search["value"], filters, limit=limit, fields=fields
+        )
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST
+
+    return [Shopcart.serialize_row(row, fields) for row in rows], status.HTTP_200_OK
+
 
-    # Initialize an empty list to store unique user shopcarts
-    shopcarts_list = []
+def get_shopcart_stats_controller():
+    """Summarize the carts holding the matching items
 
-    if not request.args:
-        app.logger.info("Request to list all shopcarts")
-        all_items = Shopcart.all()
-    else:
-        app.logger.info("Request to list shopcarts with filters")
+    The statistics are computed by the database in one query, overall or
+    per group of the 'group_by' query parameter, so clients do not need to
+    download every item to total them.
+    """
+    app.logger.info("Request for shopcart statistics")
 
-        try:
-            filters = helpers.extract_item_filters(request.args)
-            all_items = Shopcart.find_all_with_filter(filters=filters)
-        except ValueError as ve:
-            return str(ve), status.HTTP_400_BAD_REQUEST
+    try:
+        filters = helpers.extract_item_filters(request.args)
+        group_by = helpers.parse_group_by(request.args.get("group_by"))
+        stats = Shopcart.cart_stats(
+            filters, group_by, max_groups=app.config["QUERY_ROW_BUDGET"]
+        )
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST
+    except QueryTooLargeError as error:
+        return (
+            f"About {error.estimate} groups match, over the limit of {error.budget}. "
+            "Narrow the filters or group by a longer period.",
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    if group_by is None:
+        return stats[0], status.HTTP_200_OK
+    return stats, status.HTTP_200_OK
 
-    # Group items by user_id
-    user_items = {}
-    for item in all_items:
-        if item.user_id not in user_items:
-            user_items[item.user_id] = []
-        user_items[item.user_id].append(item.serialize())
 
-    # Create the response list
-    for user_id, items in user_items.items():
-        shopcarts_list.append({"user_id": user_id, "items": items})
+def stream_shopcarts_controller():
+    """Stream every matching shopcart as newline-delimited JSON
 
-    return shopcarts_list, status.HTTP_200_OK
+    Items arrive ordered by user_id, so each cart is complete as soon as
+    the next user's first item is read and can be sent right away. A
+    stream of more than QUERY_ROW_BUDGET items is refused with 413.
+    """
+    app.logger.info("Request to stream shopcarts")
+
+    try:
+        filters = helpers.extract_item_filters(request.args)
+        fields = helpers.parse_fields(request.args.get("fields"))
+        helpers.parse_format(request.args.get("format"))
+        if "sort" in request.args:
+            # Carts are streamed whole, which needs the items in user_id order
+            raise ValueError("sort is not supported when streaming; page with format=columnar")
+        # The rows are grouped by user_id even when the items leave it out
+        columns = fields and tuple(dict.fromkeys(("user_id",) + fields))
+        items = Shopcart.stream(
+            filters,
+            batch_size=app.config["STREAM_BATCH_SIZE"],
+            fields=columns,
+            max_rows=app.config["QUERY_ROW_BUDGET"],
+        )
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST
+    except QueryTooLargeError as error:
+        return (
+            f"About {error.estimate} items match, over the streaming limit of {error.budget}. "
+            "Page through them with limit and next, or narrow the filters.",
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    def generate():
+        for user_id, user_items in groupby(items, key=attrgetter("user_id")):
+            cart = {
+                "user_id": user_id,
+                "items": [Shopcart.serialize_row(row, fields) for row in user_items],
+            }
+            yield json.dumps(cart) + "\n"
+
+    response = app.response_class(
+        stream_with_context(generate()), mimetype=helpers.NDJSON_MIMETYPE
+    )
+    return response, status.HTTP_200_OK
 
 
 def get_user_shopcart_controller(user_id):
@@ -51,19 +172,18 @@ def get_user_shopcart_controller(user_id):
             try:
                 filters = helpers.extract_item_filters(request.args)
                 filters["user_id"] = {"operator": "eq", "value": str(user_id)}
-                user_items = Shopcart.find_all_with_filter(filters=filters)
+                fields = helpers.parse_fields(request.args.get("fields"))
+                user_items = Shopcart.find_rows_with_filter(filters, fields)
             except ValueError as ve:
                 return str(ve), status.HTTP_400_BAD_REQUEST
+            user_items = [Shopcart.serialize_row(row, fields) for row in user_items]
         else:
-            user_items = Shopcart.find_by_user_id(user_id=user_id)
+            user_items = helpers.load_serialized_cart(user_id)
 
         if not user_items:
             return f"User with id '{user_id}' was not found.", status.HTTP_404_NOT_FOUND
 
-        user_list = [{"user_id": user_id, "items": []}]
-        for item in user_items:
-            user_list[0]["items"].append(item.serialize())
-        return user_list, status.HTTP_200_OK
+        return [{"user_id": user_id, "items": user_items}], status.HTTP_200_OK
     except HTTPException as e:
         raise e
     except Exception as e:  # pylint: disable=broad-except
@@ -79,18 +199,28 @@ def get_user_shopcart_items_controller(user_id):
     app.logger.info("Request to get all items for user_id: '%s'", user_id)
 
     try:
-        user_items = Shopcart.find_by_user_id(user_id=user_id)
+        fields = helpers.parse_fields(request.args.get("fields"), ITEM_LISTING_FIELDS)
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST
 
-        if not user_items:
+    try:
+        if fields:
+            # Only the requested columns are read
+            items = [
+                Shopcart.serialize_row(row, fields)
+                for row in Shopcart.find_rows_by_user_id(user_id, fields)
+            ]
+        else:
+            # The cached cart is shared, so its items are copied without
+            # their timestamps
+            items = [
+                {key: value for key, value in item.items() if key not in TIMESTAMPS}
+                for item in helpers.load_serialized_cart(user_id)
+            ]
+
+        if not items:
             return f"User with id '{user_id}' was not found.", status.HTTP_404_NOT_FOUND
-        # Just return the serialized items directly as a list
-        items_list = [{"user_id": user_id, "items": []}]
-        for item in user_items:
-            data = item.serialize()
-            del data["created_at"]
-            del data["last_updated"]
-            items_list[0]["items"].append(data)
-        return items_list, status.HTTP_200_OK
+        return [{"user_id": user_id, "items": items}], status.HTTP_200_OK
     except HTTPException as e:
         raise e
     except Exception as e:  # pylint: disable=broad-except
@@ -106,13 +236,27 @@ def get_cart_item_controller(user_id, item_id):
     app.logger.info("Request to get item %s for user_id: %s", item_id, user_id)
 
     try:
-        # First check if the user exists by trying to get any items for this user
-        user_items = Shopcart.find_by_user_id(user_id=user_id)
+        fields = helpers.parse_fields(request.args.get("fields"))
+    except ValueError as ve:
+        return str(ve), status.HTTP_400_BAD_REQUEST
+
+    try:
+        # First check if the user exists by reading the user's cart
+        if fields:
+            columns = tuple(dict.fromkeys(("item_id",) + fields))
+            rows = Shopcart.find_rows_by_user_id(user_id, columns)
+            user_items = [
+                (row.item_id, Shopcart.serialize_row(row, fields)) for row in rows
+            ]
+        else:
+            user_items = [
+                (item["item_id"], item) for item in helpers.load_serialized_cart(user_id)
+            ]
         if not user_items:
             return f"User with id '{user_id}' was not found.", status.HTTP_404_NOT_FOUND
 
-        # Now try to find the specific item
-        cart_item = Shopcart.find(user_id, item_id)
+        # Now look for the specific item in the cart
+        cart_item = next((item for key, item in user_items if key == item_id), None)
         if not cart_item:
             return (
                 f"Item {item_id} not found in user {user_id}'s cart",
@@ -120,7 +264,7 @@ def get_cart_item_controller(user_id, item_id):
             )
 
         # Return the serialized item
-        return cart_item.serialize(), status.HTTP_200_OK
+        return cart_item, status.HTTP_200_OK
 
     except HTTPException as e:
         raise e
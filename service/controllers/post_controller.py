@@ -28,37 +28,24 @@ def add_to_or_create_cart_controller(user_id):
     except (KeyError, ValueError, TypeError) as e:
         return f"Invalid input: {e}", status.HTTP_400_BAD_REQUEST
 
-    # Check if this item is already in the user's cart
-    cart_item = Shopcart.find(user_id, item_id)
-    if cart_item:
-        # Update the existing item's quantity
-        cart_item.quantity += quantity
-        try:
-            cart_item.update()
-        except Exception as e:  # pylint: disable=broad-except
-            return (
-                {"error": f"Internal server error: {str(e)}"},
-                status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-    else:
-        # Create a new cart entry
-        new_item = Shopcart(
-            user_id=user_id,
-            item_id=item_id,
-            description=description,
-            quantity=quantity,
-            price=price,
+    # Create the cart entry or add to its quantity in a single statement
+    new_item = Shopcart(
+        user_id=user_id,
+        item_id=item_id,
+        description=description,
+        quantity=quantity,
+        price=price,
+    )
+    try:
+        cart_items = new_item.upsert()
+    except Exception as e:  # pylint: disable=broad-except
+        return (
+            {"error": f"Internal server error: {str(e)}"},
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
-        try:
-            new_item.create()
-        except Exception as e:  # pylint: disable=broad-except
-            return (
-                str(e),
-                status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
 
     # Return the updated cart for the user
-    cart = [item.serialize() for item in Shopcart.find_by_user_id(user_id)]
+    cart = [item.serialize() for item in cart_items]
     return cart, status.HTTP_201_CREATED
 
 
@@ -104,7 +91,7 @@ def checkout_controller(user_id):
         return (
             {
                 "message": f"Cart {user_id} checked out successfully",
-                "total_price": total_price,
+                "total_price": float(total_price),
             },
             status.HTTP_200_OK,
         )
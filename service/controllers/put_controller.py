@@ -24,7 +24,7 @@ def update_shopcart_controller(user_id):
     if not data:
         response_body = "Missing JSON payload"
         status_code = status.HTTP_400_BAD_REQUEST
-    elif not Shopcart.find_by_user_id(user_id):
+    elif not Shopcart.find_rows_by_user_id(user_id):
         response_body = f"Shopcart for user {user_id} not found"
         status_code = status.HTTP_404_NOT_FOUND
     else:
@@ -34,7 +34,8 @@ def update_shopcart_controller(user_id):
             process_cart_updates(user_id, items)
             # Get the updated cart for response
             updated_cart = [
-                item.serialize() for item in Shopcart.find_by_user_id(user_id)
+                Shopcart.serialize_row(row)
+                for row in Shopcart.find_rows_by_user_id(user_id)
             ]
             response_body = updated_cart
         except ValueError as e:
@@ -42,7 +43,7 @@ def update_shopcart_controller(user_id):
             response_body = str(e)
             status_code = status.HTTP_400_BAD_REQUEST
         except LookupError as e:
-            # Item-not-found error from update_cart_item_helper
+            # Item-not-found error from process_cart_updates
             response_body = str(e)
             status_code = status.HTTP_404_NOT_FOUND
         except Exception as e:  # pylint: disable=broad-except
@@ -20,20 +20,134 @@ last_updated (datetime) - the timestamp of the most recent update to the item in
 
 import math
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 from decimal import Decimal
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    Float,
+    Integer,
+    and_,
+    any_,
+    bindparam,
+    case,
+    column,
+    delete,
+    or_,
+    select,
+    tuple_,
+    type_coerce,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, array, insert
+from sqlalchemy.orm import aliased
+from service.common import cart_cache, filter_cache, read_cache
+from service.common.pool_metrics import InstrumentedQueuePool
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Committed instances keep their values, so responses can be built from them
+# without reloading every row
+db = SQLAlchemy(
+    engine_options={"poolclass": InstrumentedQueuePool},
+    session_options={"expire_on_commit": False},
+)
+
+# The fields of a serialized cart item, which ?fields= can choose from
+ITEM_FIELDS = (
+    "user_id",
+    "item_id",
+    "description",
+    "quantity",
+    "price",
+    "created_at",
+    "last_updated",
+)
+
+# Columns ?sort= can order by. Each one leads a btree index (the primary key
+# for user_id), so a sorted page is read in index order instead of sorting
+# every matching row
+SORT_FIELDS = ("user_id", "item_id", "quantity", "price", "created_at", "last_updated")
+
+# Groups cart statistics can be computed by: each user, or the day, week or
+# month the items were created in
+STATS_GROUPS = ("user_id", "day", "week", "month")
+
+# Percentiles of cart value and size reported by cart_stats()
+STATS_PERCENTILES = (0.5, 0.9, 0.99)
+
+# Single-column indexes replaced by the *_sort indexes, dropped by flask db-migrate
+RETIRED_INDEXES = (
+    "ix_shopcart_item_id",
+    "ix_shopcart_price",
+    "ix_shopcart_quantity",
+    "ix_shopcart_created_at",
+    "ix_shopcart_last_updated",
+)
+
+# The order items are listed in by default, as (field, descending) pairs
+DEFAULT_SORT = (("user_id", False), ("item_id", False))
+
+# Columns that can only be filtered by exact match (see ix_shopcart_description)
+# or searched for a substring with ?q= (see TRIGRAM_INDEX)
+EXACT_MATCH_FIELDS = ("description",)
+
+# The GIN trigram index serving ?q= searches, built by flask db-migrate when
+# the pg_trgm extension can be installed. It is not declared on the table,
+# so db.create_all() still works on databases without the extension
+TRIGRAM_INDEX = "ix_shopcart_description_trgm"
+
+# Tells whether pg_trgm is installed in the current database
+TRIGRAM_INSTALLED = select(
+    select(column("extname")).select_from(db.table("pg_extension"))
+    .where(column("extname") == "pg_trgm")
+    .exists()
+)
+
+# Session.info key counting the open Shopcart.batch() blocks
+BATCH_DEPTH = "shopcart_batch_depth"
+
+# Session.info key collecting the user_ids whose carts have uncommitted changes
+CHANGED_CARTS = "shopcart_changed_carts"
+
+
+def _isoformat(timestamp):
+    """Formats a timestamp column in SQL the way datetime.isoformat() does
+
+    to_json() drops trailing zeros from the fraction of a second, while
+    isoformat() always writes six digits, or none when the fraction is zero.
+    """
+    return db.func.to_char(timestamp, 'YYYY-MM-DD"T"HH24:MI:SS') + case(
+        (db.func.date_trunc("second", timestamp) != timestamp, db.func.to_char(timestamp, ".US")),
+        else_="",
+    )
+
+
+def _serialize_column(name, value):
+    """Converts a column value the way serialize() does"""
+    if name == "price":
+        return float(value)
+    if name in ("created_at", "last_updated"):
+        return value.isoformat()
+    return value
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class QueryTooLargeError(Exception):
+    """Used when a query would return more rows than its budget allows"""
+
+    def __init__(self, estimate, budget):
+        super().__init__(f"The query would return about {estimate} rows, over the budget of {budget}")
+        self.estimate = estimate
+        self.budget = budget
+
+
 class Shopcart(db.Model):
     """
     Class that represents a shopcart entry
@@ -42,6 +156,31 @@ class Shopcart(db.Model):
     ##################################################
     # Table Schema
     ##################################################
+    # Read server-generated timestamps back with RETURNING on INSERT/UPDATE
+    __mapper_args__ = {"eager_defaults": True}
+
+    # Each SORT_FIELDS column leads an index that ends with the rest of the
+    # primary key, so a sorted page is read straight from the index (in
+    # either direction) with no sort of the ties; the indexes also serve
+    # the filters on their leading column
+    __table_args__ = (
+        db.Index("ix_shopcart_item_id_sort", "item_id", "user_id"),
+        db.Index("ix_shopcart_price_sort", "price", "user_id", "item_id"),
+        db.Index("ix_shopcart_quantity_sort", "quantity", "user_id", "item_id"),
+        db.Index("ix_shopcart_created_at_sort", "created_at", "user_id", "item_id"),
+        db.Index("ix_shopcart_last_updated_sort", "last_updated", "user_id", "item_id"),
+        # Descriptions may be too long for a btree; the description filter
+        # only supports exact matches, which a hash index can serve, and
+        # substring searches, which TRIGRAM_INDEX serves
+        db.Index("ix_shopcart_description", "description", postgresql_using="hash"),
+    )
+
+    # Statements of the *_rows() readers, see _rows_statement()
+    _row_statements = {}
+
+    # Whether the database has pg_trgm, see trigram_search()
+    _trigram = None
+
     user_id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.Text)
@@ -88,6 +227,64 @@ class Shopcart(db.Model):
     def __repr__(self):
         return f"<Shopcart user_id={self.user_id} item_id={self.item_id}>"
 
+    @staticmethod
+    def _commit(user_id):
+        """Commits the session unless a batch() block is collecting changes
+
+        The cart of user_id is dropped from the cart cache once the change
+        has been committed.
+        """
+        read_cache.invalidate()
+        db.session.info.setdefault(CHANGED_CARTS, set()).add(user_id)
+        if not db.session.info.get(BATCH_DEPTH):
+            db.session.commit()
+            cart_cache.cache.invalidate(*db.session.info.pop(CHANGED_CARTS))
+
+    @staticmethod
+    def _rollback():
+        """Rolls back the session unless a batch() block owns the transaction"""
+        read_cache.invalidate()
+        if not db.session.info.get(BATCH_DEPTH):
+            db.session.rollback()
+            db.session.info.pop(CHANGED_CARTS, None)
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """
+        Stages every Shopcart change made inside the block into one commit
+
+        Nested blocks join the outermost one. Writers that fail inside the
+        block leave the rollback to it, so an error caught in the block does
+        not discard earlier changes. If the block raises, every staged change
+        is rolled back and the error is re-raised; if the final commit fails
+        it is rolled back and raised as a DataValidationError.
+        """
+        depth = db.session.info.get(BATCH_DEPTH, 0)
+        db.session.info[BATCH_DEPTH] = depth + 1
+        try:
+            yield
+        except Exception:
+            if depth == 0:
+                read_cache.invalidate()
+                db.session.rollback()
+                db.session.info.pop(CHANGED_CARTS, None)
+            raise
+        finally:
+            db.session.info[BATCH_DEPTH] = depth
+
+        if depth == 0:
+            logger.info("Committing batched Shopcart changes")
+            try:
+                db.session.commit()
+            except Exception as e:
+                read_cache.invalidate()
+                db.session.rollback()
+                db.session.info.pop(CHANGED_CARTS, None)
+                logger.error("Error committing batched changes")
+                raise DataValidationError(e) from e
+            cart_cache.cache.invalidate(*db.session.info.pop(CHANGED_CARTS, ()))
+
     def create(self):
         """
         Creates a shopcart entry to the database
@@ -98,12 +295,70 @@ class Shopcart(db.Model):
         )
         try:
             db.session.add(self)
-            db.session.commit()
+            self._commit(self.user_id)
         except Exception as e:
-            db.session.rollback()
+            self._rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
 
+    def upsert(self, max_quantity=None):
+        """
+        Adds this entry to the cart, or adds its quantity to an existing entry
+
+        The read and the increment happen in one INSERT ... ON CONFLICT
+        statement, so concurrent adds of the same item are never lost. The
+        statement runs as a CTE whose RETURNING row is combined with the rest
+        of the cart, so the whole cart comes back in the same round trip.
+
+        :param max_quantity: optional cap on the resulting quantity
+        :type max_quantity: int
+
+        :return: the cart after the change ordered by item_id, or None if the
+            cap would be exceeded
+        :rtype: list
+        """
+        self.validate()
+        logger.info(
+            "Upserting entry user_id: '%s', item_id: '%s'", self.user_id, self.item_id
+        )
+        cls = type(self)
+        table = cls.__table__
+        stmt = insert(table).values(
+            user_id=self.user_id,
+            item_id=self.item_id,
+            description=self.description,
+            quantity=self.quantity,
+            price=self.price,
+        )
+        new_quantity = table.c.quantity + stmt.excluded.quantity
+        upserted = (
+            stmt.on_conflict_do_update(
+                index_elements=[table.c.user_id, table.c.item_id],
+                set_={"quantity": new_quantity, "last_updated": db.func.now()},
+                where=new_quantity <= max_quantity if max_quantity is not None else None,
+            )
+            .returning(*table.c)
+            .cte("upserted")
+        )
+        # The rest of the statement sees the cart as it was before the upsert
+        others = select(table).where(
+            table.c.user_id == self.user_id, table.c.item_id != self.item_id
+        )
+        cart = aliased(cls, union_all(select(upserted), others).subquery("cart"))
+        try:
+            items = db.session.scalars(
+                select(cart).order_by(cart.item_id),
+                execution_options={"populate_existing": True},
+            ).all()
+            self._commit(self.user_id)
+        except Exception as e:
+            self._rollback()
+            logger.error("Error upserting record: %s", self)
+            raise DataValidationError(e) from e
+        if not any(item.item_id == self.item_id for item in items):
+            return None
+        return items
+
     def update(self):
         """
         Updates a Shopcarts to the database
@@ -111,9 +366,9 @@ class Shopcart(db.Model):
         self.validate()
         logger.info("Saving user_id: '%s', item_id: '%s'", self.user_id, self.item_id)
         try:
-            db.session.commit()
+            self._commit(self.user_id)
         except Exception as e:
-            db.session.rollback()
+            self._rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
 
@@ -122,9 +377,9 @@ class Shopcart(db.Model):
         logger.info("Deleting user_id: '%s', item_id: '%s'", self.user_id, self.item_id)
         try:
             db.session.delete(self)
-            db.session.commit()
+            self._commit(self.user_id)
         except Exception as e:
-            db.session.rollback()
+            self._rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
 
@@ -140,6 +395,27 @@ class Shopcart(db.Model):
             "last_updated": self.last_updated.isoformat(),
         }
 
+    @staticmethod
+    def serialize_row(row, fields=None):
+        """Serializes a row read by one of the *_rows() methods into a dictionary
+
+        Produces the same dictionary as serialize() without building a
+        Shopcart instance first, or only the given fields of it for a row
+        read with a narrower column list.
+        """
+        if fields is not None:
+            return {name: _serialize_column(name, getattr(row, name)) for name in fields}
+        user_id, item_id, description, quantity, price, created_at, last_updated = row
+        return {
+            "user_id": user_id,
+            "item_id": item_id,
+            "description": description,
+            "quantity": quantity,
+            "price": float(price),
+            "created_at": created_at.isoformat(),
+            "last_updated": last_updated.isoformat(),
+        }
+
     def deserialize(self, data):
         """
         Deserializes a Shopcart entry from a dictionary
@@ -179,12 +455,164 @@ class Shopcart(db.Model):
     ##################################################
 
     @classmethod
+    @read_cache.memoize_read
     def all(cls):
         """Returns all of the Shopcarts in the database"""
         logger.info("Processing all Shopcarts")
         return cls.query.all()
 
     @classmethod
+    def _rows_statement(cls, name, build):
+        """Returns a read-only Core statement, building it on first use
+
+        The statements take their values as bind parameters, so they are
+        built once per process and their compiled SQL is reused from the
+        engine's statement cache.
+        """
+        stmt = cls._row_statements.get(name)
+        if stmt is None:
+            stmt = cls._row_statements[name] = build(cls.__table__)
+        return stmt
+
+    @classmethod
+    def _select_fields(cls, fields=None):
+        """Returns a SELECT of the given columns, or of every column"""
+        table = cls.__table__
+        if fields is None:
+            return select(table)
+        return select(*(table.c[name] for name in fields))
+
+    @classmethod
+    @read_cache.memoize_read
+    def all_rows(cls):
+        """Returns every Shopcart entry as a plain row
+
+        Rows are read through SQLAlchemy Core, so no instances are created
+        or tracked by the session. Use serialize_row() to turn them into
+        dictionaries; use all() when the entries will be changed.
+
+        :return: the rows ordered by (user_id, item_id)
+        :rtype: list
+        """
+        logger.info("Processing all Shopcart rows")
+        stmt = cls._rows_statement(
+            "all", lambda table: select(table).order_by(table.c.user_id, table.c.item_id)
+        )
+        return db.session.execute(stmt).all()
+
+    @classmethod
+    @read_cache.memoize_read
+    def find_rows_by_user_id(cls, user_id, fields=None):
+        """Returns the entries of a user's cart as plain rows
+
+        :param user_id: the id of the user whose cart is read
+        :type user_id: int
+        :param fields: the columns to read, all of them by default
+        :type fields: tuple
+
+        :return: the rows of the cart ordered by item_id
+        :rtype: list
+        """
+        logger.info("Processing row lookup for user_id %s ...", user_id)
+        stmt = cls._rows_statement(
+            ("by_user_id", fields),
+            lambda table: cls._select_fields(fields)
+            .where(table.c.user_id == bindparam("user_id"))
+            .order_by(table.c.item_id),
+        )
+        return db.session.execute(stmt, {"user_id": user_id}).all()
+
+    @classmethod
+    @read_cache.memoize_read
+    def find_rows_with_filter(cls, filters=None, fields=None):
+        """Returns the entries matching optional filters as plain rows
+
+        :param filters: optional filters to apply
+        :type filters: dict
+        :param fields: the columns to read, all of them by default
+        :type fields: tuple
+
+        :return: the matching rows ordered by (user_id, item_id)
+        :rtype: list
+        """
+        logger.info("Finding rows with filters %s", filters)
+        table = cls.__table__
+        shape, params = cls._compile_filters(filters)
+        stmt = cls._filter_statement(
+            ("rows", fields),
+            shape,
+            lambda conditions: cls._select_fields(fields)
+            .where(*conditions)
+            .order_by(table.c.user_id, table.c.item_id),
+        )
+        return db.session.execute(stmt, params).all()
+
+    @classmethod
+    def trigram_search(cls):
+        """Tells whether descriptions are ranked with pg_trgm
+
+        The database is asked once per process; without the extension,
+        searches fall back to scanning the descriptions with ILIKE.
+        """
+        if cls._trigram is None:
+            cls._trigram = db.session.execute(TRIGRAM_INSTALLED).scalar()
+            if not cls._trigram:
+                logger.warning("pg_trgm is not installed; description searches will scan the table")
+        return cls._trigram
+
+    @classmethod
+    def _search_statement(cls, conditions, fields, trigram):
+        """Builds the query of search_descriptions(), best match first"""
+        table = cls.__table__
+        if trigram:
+            # The share of trigrams the description and the query have in common
+            relevance = db.func.similarity(
+                table.c.description, bindparam("query", type_=db.Text)
+            ).desc()
+        else:
+            # Every match contains the query, so it is most of the shorter ones
+            relevance = db.func.length(table.c.description)
+        return (
+            cls._select_fields(fields)
+            .where(*conditions)
+            .order_by(relevance, table.c.user_id, table.c.item_id)
+            .limit(bindparam("limit", type_=Integer))
+        )
+
+    @classmethod
+    @read_cache.memoize_read
+    def search_descriptions(cls, query, filters=None, limit=100, fields=None):
+        """Returns the entries whose description contains a text, best match first
+
+        The text is matched case-insensitively with ILIKE, which the
+        trigram index serves. Matches are ranked by their similarity to the
+        text when pg_trgm is installed, and by length otherwise.
+
+        :param query: the text to look for
+        :type query: str
+        :param filters: optional filters the entries must also match
+        :type filters: dict
+        :param limit: the most entries to return
+        :type limit: int
+        :param fields: the columns to read, all of them by default
+        :type fields: tuple
+
+        :return: at most limit rows, the most relevant first
+        :rtype: list
+        """
+        logger.info("Searching descriptions for %r with filters %s", query, filters)
+        filters = {**(filters or {}), "description": {"operator": "contains", "value": query}}
+        shape, params = cls._compile_filters(filters)
+        trigram = cls.trigram_search()
+        stmt = cls._filter_statement(
+            ("search", fields, trigram),
+            shape,
+            lambda conditions: cls._search_statement(conditions, fields, trigram),
+        )
+        return db.session.execute(stmt, {**params, "query": query, "limit": limit}).all()
+
+    @classmethod
+    @read_cache.memoize_read
     def find(cls, user_id, item_id):
         """Finds a Shopcart entry by user_id and item_id
 
@@ -203,12 +631,77 @@ class Shopcart(db.Model):
         return cls.query.get((user_id, item_id))
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_user_id(cls, user_id):
         """Finds a Shopcarts by user_id"""
         logger.info("Processing lookup for user_id %s ...", user_id)
         return cls.query.filter_by(user_id=user_id).all()
 
     @classmethod
+    @read_cache.memoize_read
+    def find_item_ids(cls, user_id, item_ids):
+        """Returns which of the given item_ids are in a user's cart
+
+        :param user_id: the id of the user whose cart is checked
+        :type user_id: int
+        :param item_ids: the item ids to look for
+        :type item_ids: list
+
+        :return: the subset of item_ids present in the cart
+        :rtype: set
+        """
+        logger.info("Processing item lookup for user_id %s ...", user_id)
+        query = select(cls.item_id).where(
+            cls.user_id == user_id, cls.item_id.in_(item_ids)
+        )
+        return set(db.session.scalars(query))
+
+    @classmethod
+    def fingerprint(cls, user_id, item_id=None, lock=False):
+        """Summarizes a cart, or one item in it, with one aggregate query
+
+        :param user_id: the id of the user who owns the cart
+        :type user_id: int
+        :param item_id: the item to summarize instead of the whole cart
+        :type item_id: int
+        :param lock: lock the rows until the transaction ends, so they
+            cannot change between a precondition check and a write
+        :type lock: bool
+
+        :return: the row count, the latest last_updated and an md5 of the
+            rows, or None if there are no rows
+        :rtype: tuple
+        """
+        rows = select(cls.__table__).where(cls.user_id == user_id)
+        if item_id is not None:
+            rows = rows.where(cls.item_id == item_id)
+        if lock:
+            rows = rows.with_for_update()
+        rows = rows.subquery("fingerprinted")
+        row_text = db.func.concat_ws(
+            "|",
+            rows.c.item_id,
+            rows.c.quantity,
+            rows.c.price,
+            rows.c.created_at,
+            rows.c.last_updated,
+            rows.c.description,
+        )
+        count, last_updated, digest = db.session.execute(
+            select(
+                db.func.count(),
+                db.func.max(rows.c.last_updated),
+                db.func.md5(
+                    db.func.string_agg(row_text, aggregate_order_by("\n", rows.c.item_id))
+                ),
+            )
+        ).one()
+        if not count:
+            return None
+        return count, last_updated, digest
+
+    @classmethod
+    @read_cache.memoize_read
     def find_by_description(cls, description):
         """Returns all Shopcarts with the given description
 
@@ -222,6 +715,7 @@ class Shopcart(db.Model):
         return cls.query.filter_by(description=description).all()
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_quantity(cls, quantity):
         """Returns all Shopcarts with the given quantity
 
@@ -235,6 +729,7 @@ class Shopcart(db.Model):
         return cls.query.filter_by(quantity=quantity).all()
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_price(cls, price):
         """Returns all Shopcarts with the given price
 
@@ -248,6 +743,7 @@ class Shopcart(db.Model):
         return cls.query.filter_by(price=price).all()
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_created_at(cls, created_at):
         """Returns all Shopcarts created at the specified datetime
 
@@ -261,6 +757,7 @@ class Shopcart(db.Model):
         return cls.query.filter_by(created_at=created_at).all()
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_last_updated(cls, last_updated):
         """Returns all Shopcarts last updated at the specified datetime
 
@@ -274,6 +771,7 @@ class Shopcart(db.Model):
         return cls.query.filter_by(last_updated=last_updated).all()
 
     @classmethod
+    @read_cache.memoize_read
     def find_by_ranges(cls, filters=None):
         """Finds all shopcart items based on optional ranges"""
         logger.info("Finding items with dynamic filters")
@@ -302,95 +800,695 @@ class Shopcart(db.Model):
             cls.last_updated <= max_update,
         ).all()
 
+    # Converters of the filter values of each field, which arrive as strings
+    _filter_converters = {
+        "price": float,
+        "quantity": int,
+        "user_id": int,
+        "item_id": int,
+        "created_at": datetime.fromisoformat,
+        "last_updated": datetime.fromisoformat,
+    }
+
     @classmethod
-    def _build_filter_conditions(cls, filters):
-        """Creates filter conditions from filter dict
-        This is a private helper method to reduce complexity
-        """
-        conditions = []
+    def _compile_filters(cls, filters):
+        """Validates a filter dict and splits it into its shape and values
 
-        # Dictionary mapping field types to conversion functions
-        type_converters = {
-            "price": float,
-            "quantity": int,
-            "user_id": int,
-            "item_id": int,
-            "created_at": datetime.fromisoformat,
-            "last_updated": datetime.fromisoformat,
-        }
+        The shape names the field and operator of every filter, in field
+        order; the values are converted to the column types and keyed by
+        the bind parameters of _filter_conditions(). Compiled filters are
+        kept in the filter cache, so a repeated filter is not converted
+        again.
 
-        for field, condition in filters.items():
-            model_attr = getattr(cls, field)
-            operator = condition["operator"]
+        :return: the (shape, params) of the filters
+        :rtype: tuple
+        """
+        if not filters:
+            return (), {}
+        key = []
+        for field, condition in sorted(filters.items()):
             value = condition["value"]
+            if isinstance(value, list):
+                value = tuple(value)
+            key.append((field, condition["operator"], value))
+        key = tuple(key)
+        return filter_cache.cache.get_or_build(
+            ("filters", key), lambda: cls._convert_filters(key)
+        )
+
+    @classmethod
+    def _convert_filters(cls, key):
+        """Converts the (field, operator, value) triples of a filter key"""
+        shape = []
+        params = {}
+        for field, operator, value in key:
+            if field in EXACT_MATCH_FIELDS and operator not in ("eq", "contains"):
+                raise ValueError(f"{field} only supports exact matches")
+
+            if isinstance(value, tuple):
+                value = list(value)
 
             # Convert value
-            if field in type_converters:
+            if field in cls._filter_converters:
+                converter = cls._filter_converters[field]
                 try:
                     if isinstance(value, list):
-                        value = [type_converters[field](v) for v in value]
+                        value = [converter(v) for v in value]
                     else:
-                        value = type_converters[field](value)
+                        value = converter(value)
                 except (ValueError, TypeError) as exc:
                     raise ValueError(f"Invalid value for {field}: {value}") from exc
 
             match operator:
-                case "eq":
-                    conditions.append(model_attr == value)
-                case "lt":
-                    conditions.append(model_attr < value)
-                case "lte":
-                    conditions.append(model_attr <= value)
-                case "gt":
-                    conditions.append(model_attr > value)
-                case "gte":
-                    conditions.append(model_attr >= value)
+                case "eq" | "lt" | "lte" | "gt" | "gte":
+                    params[f"filter_{field}"] = value
                 case "in":
-                    if isinstance(value, list):
-                        conditions.append(model_attr.in_(value))
-                    else:
+                    if not isinstance(value, list):
                         raise ValueError(
                             f"Invalid 'in' operator value for {field}: must be a list"
                         )
+                    params[f"filter_{field}"] = value
                 case "range":
-                    if isinstance(value, list) and len(value) == 2:
-                        if value[0] > value[1]:
-                            raise ValueError(
-                                f"min value cannot be greater than max value in {field}_range"
-                            )
-                        conditions.append(model_attr >= value[0])
-                        conditions.append(model_attr <= value[1])
-                    else:
+                    if not isinstance(value, list) or len(value) != 2:
                         raise ValueError(
                             f"Invalid 'range' operator value for {field}: must be a list of two values"
                         )
+                    if value[0] > value[1]:
+                        raise ValueError(
+                            f"min value cannot be greater than max value in {field}_range"
+                        )
+                    params[f"filter_{field}_min"], params[f"filter_{field}_max"] = value
+                case "contains":
+                    if field not in EXACT_MATCH_FIELDS:
+                        raise ValueError(f"{field} cannot be searched")
+                    # Match the text literally, wherever it is, in any case
+                    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                    params[f"filter_{field}"] = f"%{escaped}%"
                 case _:
                     raise ValueError(f"Unsupported operator: {operator}")
+            shape.append((field, operator))
+        return tuple(shape), params
+
+    @classmethod
+    def _filter_conditions(cls, shape):
+        """Creates the conditions of a filter shape, with bind parameters
 
+        An 'in' filter is bound as a single array, = ANY(:filter_<field>),
+        so the SQL text is the same whatever the length of the list.
+        """
+        table = cls.__table__
+        conditions = []
+        for field, operator in shape:
+            column_ = table.c[field]
+            value = bindparam(f"filter_{field}", type_=column_.type)
+            match operator:
+                case "eq":
+                    conditions.append(column_ == value)
+                case "lt":
+                    conditions.append(column_ < value)
+                case "lte":
+                    conditions.append(column_ <= value)
+                case "gt":
+                    conditions.append(column_ > value)
+                case "gte":
+                    conditions.append(column_ >= value)
+                case "in":
+                    values = bindparam(f"filter_{field}", type_=ARRAY(column_.type))
+                    conditions.append(column_ == any_(values))
+                case "range":
+                    conditions.append(column_ >= bindparam(f"filter_{field}_min", type_=column_.type))
+                    conditions.append(column_ <= bindparam(f"filter_{field}_max", type_=column_.type))
+                case "contains":
+                    conditions.append(column_.ilike(value))
         return conditions
 
+    @classmethod
+    def _filter_statement(cls, name, shape, build):
+        """Returns the statement of a filtered read, building it on first use
+
+        build(conditions) makes the statement from the conditions of the
+        shape. Statements are kept in the filter cache under (name, shape),
+        where name also tells the other choices build() depends on.
+        """
+        return filter_cache.cache.get_or_build(
+            ("statements", name, shape), lambda: build(cls._filter_conditions(shape))
+        )
+
+    @classmethod
+    def _build_filter_conditions(cls, filters):
+        """Creates filter conditions from filter dict, with their values bound
+
+        This is a private helper method to reduce complexity
+        """
+        shape, params = cls._compile_filters(filters)
+        return [condition.params(params) for condition in cls._filter_conditions(shape)]
+
     @classmethod
     def finalize_cart(cls, user_id):
-        """Finalizes the cart for the given user_id"""
-        items = cls.find_by_user_id(user_id)
-        if not items:
-            raise DataValidationError(f"No cart found for user {user_id}")
+        """Finalizes the cart for the given user_id
 
-        # Calculate total price
-        total_price = 0.0
-        for item in items:
-            total_price += float(item.price) * item.quantity
+        The cart is removed and its total computed in a single transaction.
+        A per-user advisory lock makes concurrent checkouts of the same cart
+        wait for each other, so only one of them can succeed.
 
-        if total_price == 0.0:
-            raise DataValidationError("Cart is empty. Nothing to checkout.")
+        :param user_id: the id of the user checking out
+        :type user_id: int
 
-        # Remove each item from the database to represent "checked out"
-        for item in items:
-            item.delete()
+        :return: the exact total price of the cart
+        :rtype: Decimal
+        """
+        logger.info("Checking out cart for user_id: '%s'", user_id)
+        try:
+            db.session.execute(select(db.func.pg_advisory_xact_lock(user_id)))
+            # Remove the items to represent "checked out" and total what was removed
+            rows = db.session.execute(
+                delete(cls)
+                .where(cls.user_id == user_id)
+                .returning(cls.price, cls.quantity)
+            ).all()
+            if not rows:
+                raise DataValidationError(f"No cart found for user {user_id}")
+
+            total_price = sum(
+                (price * quantity for price, quantity in rows), Decimal("0.00")
+            )
+            if total_price == 0:
+                raise DataValidationError("Cart is empty. Nothing to checkout.")
+            cls._commit(user_id)
+        except DataValidationError:
+            cls._rollback()
+            raise
+        except Exception as e:
+            cls._rollback()
+            logger.error("Error checking out cart for user_id: %s", user_id)
+            raise DataValidationError(e) from e
 
         return total_price
 
     @classmethod
+    def delete_by_user_id(cls, user_id):
+        """Removes every entry in a user's cart with a single DELETE
+
+        :param user_id: the id of the user whose cart is removed
+        :type user_id: int
+
+        :return: the number of entries deleted
+        :rtype: int
+        """
+        logger.info("Deleting cart for user_id: '%s'", user_id)
+        try:
+            deleted = db.session.execute(
+                delete(cls).where(cls.user_id == user_id)
+            ).rowcount
+            cls._commit(user_id)
+        except Exception as e:
+            cls._rollback()
+            logger.error("Error deleting cart for user_id: %s", user_id)
+            raise DataValidationError(e) from e
+        return deleted
+
+    @classmethod
+    def update_quantities(cls, user_id, quantities):
+        """Applies a batch of quantity changes to a cart in one transaction
+
+        Items whose new quantity is 0 are removed from the cart. Either every
+        change is applied or none of them is.
+
+        :param user_id: the id of the user who owns the cart
+        :type user_id: int
+        :param quantities: the new quantity for each item_id
+        :type quantities: dict
+        """
+        if any(quantity < 0 for quantity in quantities.values()):
+            raise ValueError("Quantity cannot be less than 0.")
+
+        changed = {k: v for k, v in quantities.items() if v > 0}
+        removed = [k for k, v in quantities.items() if v == 0]
+        logger.info(
+            "Saving %d and deleting %d items for user_id: '%s'",
+            len(changed),
+            len(removed),
+            user_id,
+        )
+        try:
+            affected = 0
+            if changed:
+                new_values = values(
+                    column("item_id", Integer),
+                    column("quantity", Integer),
+                    name="new_values",
+                ).data(list(changed.items()))
+                affected += db.session.execute(
+                    update(cls)
+                    .where(
+                        cls.user_id == user_id, cls.item_id == new_values.c.item_id
+                    )
+                    .values(quantity=new_values.c.quantity)
+                ).rowcount
+            if removed:
+                affected += db.session.execute(
+                    delete(cls).where(cls.user_id == user_id, cls.item_id.in_(removed))
+                ).rowcount
+            if affected != len(quantities):
+                raise DataValidationError(
+                    f"Cart for user {user_id} was modified during the update"
+                )
+            cls._commit(user_id)
+        except DataValidationError:
+            cls._rollback()
+            logger.error("Cart for user_id: %s changed during the update", user_id)
+            raise
+        except Exception as e:
+            cls._rollback()
+            logger.error("Error updating cart for user_id: %s", user_id)
+            raise DataValidationError(e) from e
+
+    @staticmethod
+    def sort_key(sort=None):
+        """Returns the full order of a page as (field, descending) pairs
+
+        The primary key columns that sort leaves out are added after it,
+        in the direction of its last field, so every item has a unique
+        position that a page can start after.
+
+        :param sort: (field, descending) pairs of SORT_FIELDS, or None for
+            the default (user_id, item_id) order
+        :type sort: tuple
+        """
+        if not sort:
+            return DEFAULT_SORT
+        named = {field for field, _ in sort}
+        descending = sort[-1][1]
+        return tuple(sort) + tuple(
+            (field, descending) for field, _ in DEFAULT_SORT if field not in named
+        )
+
+    @classmethod
+    def _after_condition(cls, key):
+        """Selects the items past the :after_<field> values of a sort key"""
+        table = cls.__table__
+        columns = [table.c[field] for field, _ in key]
+        values = [bindparam(f"after_{field}", type_=table.c[field].type) for field, _ in key]
+        descending = [desc for _, desc in key]
+        # A bound on the leading column lets its index start at the cursor
+        bound = columns[0] <= values[0] if descending[0] else columns[0] >= values[0]
+        if len(set(descending)) == 1:
+            if descending[0]:
+                return and_(bound, tuple_(*columns) < tuple_(*values))
+            return and_(bound, tuple_(*columns) > tuple_(*values))
+        # Mixed directions cannot be compared as one row
+        beyond = [
+            and_(
+                *(column_ == value for column_, value in zip(columns[:n], values[:n])),
+                columns[n] < values[n] if descending[n] else columns[n] > values[n],
+            )
+            for n in range(len(key))
+        ]
+        return and_(bound, or_(*beyond))
+
+    @classmethod
+    def _page(cls, conditions, key, paged):
+        """Returns a subquery of the items of one page, and one row more
+
+        The page size is bound as :limit and, when paged is true, the page
+        starts after the item whose sort key is bound as :after_<field>.
+        The rows are numbered in the order of the sort key by a position
+        column, so a position past the limit tells that another page
+        follows.
+        """
+        table = cls.__table__
+        order = [table.c[field].desc() if desc else table.c[field] for field, desc in key]
+        if paged:
+            conditions = [*conditions, cls._after_condition(key)]
+        # Read one extra row to learn whether another page follows
+        return (
+            select(
+                table,
+                db.func.row_number().over(order_by=order).label("position"),
+            )
+            .where(*conditions)
+            .order_by(*order)
+            .limit(bindparam("limit", type_=Integer) + 1)
+            .subquery("page")
+        )
+
+    @staticmethod
+    def _page_params(params, limit, after, key):
+        """Adds the limit and the key a page starts after to its filter values"""
+        params = {**params, "limit": limit}
+        if after is not None:
+            params.update((f"after_{field}", value) for (field, _), value in zip(key, after))
+        return params
+
+    @staticmethod
+    def _last_key(row, key):
+        """Returns the sort key of the last item of a page from its last_<field> columns"""
+        return tuple(row._mapping[f"last_{field}"] for field, _ in key)
+
+    @staticmethod
+    def _page_values(page):
+        """Returns the SQL expressions of the serialized fields of a page"""
+        return {
+            "user_id": page.c.user_id,
+            "item_id": page.c.item_id,
+            "description": page.c.description,
+            "quantity": page.c.quantity,
+            "price": page.c.price,
+            "created_at": _isoformat(page.c.created_at),
+            "last_updated": _isoformat(page.c.last_updated),
+        }
+
+    @classmethod
+    def _cart_page_statement(cls, conditions, key, paged, fields):
+        """Builds the query of find_cart_page(), one row per cart"""
+        page = cls._page(conditions, key, paged)
+        in_page = page.c.position <= bindparam("limit", type_=Integer)
+        # The last item of a full page, which the next page starts after
+        last = page.c.position == bindparam("limit", type_=Integer)
+        values_by_field = cls._page_values(page)
+        item = db.func.json_build_object(
+            *(part for name in fields or ITEM_FIELDS for part in (name, values_by_field[name]))
+        )
+        return (
+            select(
+                page.c.user_id,
+                db.func.json_agg(aggregate_order_by(item, page.c.position))
+                .filter(in_page)
+                .label("items"),
+                *(db.func.max(page.c[field]).filter(last).label(f"last_{field}") for field, _ in key),
+                db.func.max(page.c.position).label("last_position"),
+            )
+            .group_by(page.c.user_id)
+            .order_by(db.func.min(page.c.position))
+        )
+
+    @classmethod
+    def _column_page_statement(cls, conditions, key, paged, columns):
+        """Builds the query of find_column_page(), one array per column"""
+        page = cls._page(conditions, key, paged)
+        in_page = page.c.position <= bindparam("limit", type_=Integer)
+        # The last item of a full page, which the next page starts after
+        last = page.c.position == bindparam("limit", type_=Integer)
+        values_by_field = cls._page_values(page)
+        return select(
+            *(
+                db.func.json_agg(aggregate_order_by(values_by_field[name], page.c.position))
+                .filter(in_page)
+                .label(name)
+                for name in columns
+            ),
+            *(db.func.max(page.c[field]).filter(last).label(f"last_{field}") for field, _ in key),
+            db.func.max(page.c.position).label("last_position"),
+        )
+
+    @classmethod
+    @read_cache.memoize_read
+    def find_cart_page(cls, filters=None, limit=100, after=None, fields=None, sort=None):
+        """Finds one page of items, grouped into carts by the database
+
+        The page is read in sort order, (user_id, item_id) by default, with
+        a keyset condition on the sort key, so every page costs the same no
+        matter how deep it is. Postgres groups the page by user_id and
+        builds each cart's items with json_agg, so no model instances are
+        created. Carts come in the order of their first item on the page.
+
+        :param filters: optional filters to apply
+        :type filters: dict
+        :param limit: the maximum number of items on the page
+        :type limit: int
+        :param after: the sort key (see sort_key()) the page starts after
+        :type after: tuple
+        :param fields: the item fields to build, all of them by default
+        :type fields: tuple
+        :param sort: the (field, descending) pairs to order the items by
+        :type sort: tuple
+
+        :return: the carts on the page, as {"user_id", "items"} dictionaries,
+            and the key to pass as ``after`` for the next page, or None if
+            this is the last page
+        :rtype: tuple
+        """
+        logger.info("Finding a page of %d items after %s", limit, after)
+        key = cls.sort_key(sort)
+        shape, params = cls._compile_filters(filters)
+        stmt = cls._filter_statement(
+            ("cart_page", fields, key, after is not None),
+            shape,
+            lambda conditions: cls._cart_page_statement(conditions, key, after is not None, fields),
+        )
+        rows = db.session.execute(stmt, cls._page_params(params, limit, after, key)).all()
+
+        carts = [{"user_id": row.user_id, "items": row.items} for row in rows if row.items]
+        if not rows or max(row.last_position for row in rows) <= limit:
+            return carts, None
+        # Only the cart holding the last item has its last_<field> values
+        last = next(row for row in rows if row._mapping[f"last_{key[0][0]}"] is not None)
+        return carts, cls._last_key(last, key)
+
+    @classmethod
+    @read_cache.memoize_read
+    def find_column_page(cls, filters=None, limit=100, after=None, fields=None, sort=None):
+        """Finds one page of items as one array of values per field
+
+        The page is the one find_cart_page() reads, but Postgres aggregates
+        each field into a JSON array, in sort order, so the field names are
+        not repeated for every item.
+
+        :param filters: optional filters to apply
+        :type filters: dict
+        :param limit: the maximum number of items on the page
+        :type limit: int
+        :param after: the sort key (see sort_key()) the page starts after
+        :type after: tuple
+        :param fields: the item fields to read, all of them by default
+        :type fields: tuple
+        :param sort: the (field, descending) pairs to order the items by
+        :type sort: tuple
+
+        :return: a {"columns", "data"} dictionary, where data holds the
+            values of each column, and the key to pass as ``after`` for the
+            next page, or None if this is the last page
+        :rtype: tuple
+        """
+        logger.info("Finding a page of %d item columns after %s", limit, after)
+        columns = fields or ITEM_FIELDS
+        key = cls.sort_key(sort)
+        shape, params = cls._compile_filters(filters)
+        stmt = cls._filter_statement(
+            ("column_page", columns, key, after is not None),
+            shape,
+            lambda conditions: cls._column_page_statement(conditions, key, after is not None, columns),
+        )
+        row = db.session.execute(stmt, cls._page_params(params, limit, after, key)).one()
+
+        page_data = {"columns": list(columns), "data": [row._mapping[name] or [] for name in columns]}
+        if row.last_position is None or row.last_position <= limit:
+            return page_data, None
+        return page_data, cls._last_key(row, key)
+
+    @classmethod
+    def _estimate_rows(cls, name, shape, stmt, params):
+        """Returns the planner's estimate of the rows a statement returns
+
+        Only the plan is computed; the statement is not run. The compiled
+        statement is kept in the filter cache under (name, shape).
+        """
+        compiled = filter_cache.cache.get_or_build(
+            ("explain", name, shape), lambda: stmt.compile(dialect=db.engine.dialect)
+        )
+        plan = db.session.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compiled.string}", compiled.construct_params(params)
+        ).scalar()
+        return round(plan[0]["Plan"]["Plan Rows"])
+
+    @classmethod
+    def _check_budget(cls, name, shape, stmt, params, budget):
+        """Raises QueryTooLargeError when a statement returns over budget rows
+
+        The rows are counted by running the statement with LIMIT budget + 1,
+        so the check reads no more than the budget allows, and is exact
+        where the planner's estimates can be far off for combined filters.
+        The planner's estimate of the full size is only used to report a
+        rejected query. A budget of None or 0 checks nothing.
+        """
+        if not budget:
+            return
+        probe = filter_cache.cache.get_or_build(
+            ("probe", name, shape),
+            lambda: select(db.func.count()).select_from(
+                stmt.order_by(None).limit(bindparam("budget", type_=Integer)).subquery()
+            ),
+        )
+        if db.session.execute(probe, {**params, "budget": budget + 1}).scalar() <= budget:
+            return
+        estimate = max(cls._estimate_rows(name, shape, stmt, params), budget + 1)
+        logger.warning(
+            "Rejected %s query of about %d rows, over the budget of %d, filtered by %s",
+            name[0],
+            estimate,
+            budget,
+            [f"{field} {operator}" for field, operator in shape] or "nothing",
+        )
+        raise QueryTooLargeError(estimate, budget)
+
+    @classmethod
+    def _stats_statement(cls, conditions, group_by):
+        """Builds the query of cart_stats(), one row per group
+
+        The matching items are first summed up per cart (and group), then
+        the carts are aggregated, so the whole computation is one query.
+        """
+        table = cls.__table__
+        if group_by is None:
+            groups = []
+        elif group_by == "user_id":
+            groups = [table.c.user_id.label("group")]
+        else:
+            groups = [db.func.date_trunc(group_by, table.c.created_at).label("group")]
+        carts = (
+            select(
+                *groups,
+                db.func.count().label("items"),
+                db.func.sum(table.c.quantity).label("units"),
+                db.func.sum(table.c.price * table.c.quantity).label("value"),
+            )
+            .where(*conditions)
+            .group_by(*groups, table.c.user_id)
+            .subquery("carts")
+        )
+        percentiles = array(STATS_PERCENTILES)
+        stmt = select(
+            *(carts.c.group for _ in groups),
+            db.func.count().label("carts"),
+            db.func.coalesce(db.func.sum(carts.c["items"]), 0).label("items"),
+            db.func.coalesce(db.func.sum(carts.c.units), 0).label("units"),
+            db.func.coalesce(db.func.sum(carts.c.value), 0).label("value"),
+            db.func.avg(carts.c["items"]).label("avg_items"),
+            db.func.avg(carts.c.value).label("avg_value"),
+            type_coerce(
+                db.func.percentile_cont(percentiles).within_group(carts.c["items"]),
+                ARRAY(Float),
+            ).label("items_percentiles"),
+            type_coerce(
+                db.func.percentile_cont(percentiles).within_group(carts.c.value),
+                ARRAY(Float),
+            ).label("value_percentiles"),
+        )
+        if groups:
+            stmt = stmt.group_by(carts.c.group).order_by(carts.c.group)
+        return stmt
+
+    @staticmethod
+    def _stats_row(row, group_by):
+        """Turns a row of _stats_statement() into a JSON-ready dictionary"""
+
+        def percentiles(values, digits=None):
+            if values is None:
+                return None
+            return {
+                f"p{round(percentile * 100):g}": round(value, digits) if digits else value
+                for percentile, value in zip(STATS_PERCENTILES, values)
+            }
+
+        stats = {}
+        if group_by == "user_id":
+            stats["user_id"] = row.group
+        elif group_by is not None:
+            stats[group_by] = row.group.date().isoformat()
+        stats.update(
+            {
+                "carts": row.carts,
+                "items": int(row.items),
+                "units": int(row.units),
+                "value": float(row.value),
+                "avg_cart_items": None if row.avg_items is None else float(row.avg_items),
+                "avg_cart_value": None if row.avg_value is None else round(float(row.avg_value), 2),
+                "cart_items_percentiles": percentiles(row.items_percentiles),
+                "cart_value_percentiles": percentiles(row.value_percentiles, 2),
+            }
+        )
+        return stats
+
+    @classmethod
+    @read_cache.memoize_read
+    def cart_stats(cls, filters=None, group_by=None, max_groups=None):
+        """Computes statistics of the carts holding the matching items
+
+        Only the items matching the filters are counted. A cart is the
+        matching items of one user (within one group when grouped).
+
+        :param filters: optional filters to apply
+        :type filters: dict
+        :param group_by: one of STATS_GROUPS, or None for overall totals
+        :type group_by: str
+        :param max_groups: raise QueryTooLargeError, before computing any
+            statistics, when there would be more groups than this
+        :type max_groups: int
+
+        :return: one dictionary per group, in group order, with the number
+            of carts, items and units, the total value, the average and
+            percentiles of the items and value per cart
+        :rtype: list
+        """
+        logger.info("Computing cart statistics by %s with filters %s", group_by, filters)
+        shape, params = cls._compile_filters(filters)
+        stmt = cls._filter_statement(
+            ("stats", group_by),
+            shape,
+            lambda conditions: cls._stats_statement(conditions, group_by),
+        )
+        if group_by is not None:
+            cls._check_budget(("stats", group_by), shape, stmt, params, max_groups)
+        return [cls._stats_row(row, group_by) for row in db.session.execute(stmt, params)]
+
+    @classmethod
+    def stream(cls, filters=None, batch_size=1000, fields=None, max_rows=None):
+        """Runs a query for every matching item ordered by (user_id, item_id)
+
+        Rows are fetched through a server-side cursor, batch_size at a time,
+        as the result is iterated, so the whole result is never held in memory.
+        They are plain rows, to be serialized with serialize_row().
+
+        The query runs on its own connection, checked out when iteration
+        starts and returned when it ends or the iterator is closed. A
+        streamed response is still being read after the request's session
+        has been removed, which would close a cursor opened through it.
+
+        :param filters: optional filters to apply
+        :type filters: dict
+        :param batch_size: the number of rows fetched per round trip
+        :type batch_size: int
+        :param fields: the columns to read, all of them by default
+        :type fields: tuple
+        :param max_rows: raise QueryTooLargeError, before streaming anything,
+            when more items than this match
+        :type max_rows: int
+
+        :return: an iterator over the matching rows
+        :rtype: generator
+        """
+        logger.info("Streaming items with filters %s", filters)
+        table = cls.__table__
+        shape, params = cls._compile_filters(filters)
+        stmt = cls._filter_statement(
+            ("rows", fields),
+            shape,
+            lambda conditions: cls._select_fields(fields)
+            .where(*conditions)
+            .order_by(table.c.user_id, table.c.item_id),
+        )
+        cls._check_budget(("rows", fields), shape, stmt, params, max_rows)
+        stmt = stmt.execution_options(yield_per=batch_size)
+        engine = db.engine
+
+        def rows():
+            with engine.connect() as connection:
+                yield from connection.execute(stmt, params)
+
+        return rows()
+
+    @classmethod
+    @read_cache.memoize_read
     def find_all_with_filter(cls, filters=None):
         """Finds items with optional filters
 
@@ -21,13 +21,25 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete Shopcarts
 """
 
-from flask import jsonify
+from functools import wraps
+from flask import Response, jsonify, request
 from flask import current_app as app
-from flask_restx import Api, Resource, fields, reqparse
-from service.common import status
+from flask_restx import Api, Model, Resource, fields, reqparse
+from flask_restx.utils import merge, unpack
+from werkzeug.http import quote_etag
+from service.common import compression, msgpack_codec, status
+from service.common.helpers import COLUMNAR_FORMAT, NDJSON_MIMETYPE, parse_fields
+from service.common.cart_cache import cache as cart_cache
+from service.common.filter_cache import cache as filter_cache
+from service.common.fast_json import make_json_response
+from service.common.pool_metrics import pool_stats
+from service.models import STATS_GROUPS, Shopcart, db
 
 from service.controllers.get_controller import (
     get_shopcarts_controller,
+    get_shopcart_stats_controller,
+    search_shopcarts_controller,
+    stream_shopcarts_controller,
     get_user_shopcart_controller,
     get_user_shopcart_items_controller,
     get_cart_item_controller,
@@ -63,6 +75,10 @@ api = Api(
     prefix="/api",
 )
 
+# Every resource can answer in MessagePack when the client asks for it
+if msgpack_codec.available():
+    api.representation(msgpack_codec.MSGPACK_MIMETYPE)(msgpack_codec.output_msgpack)
+
 
 ######################################################################
 # GET INDEX
@@ -89,6 +105,12 @@ def info():
                 "/shopcarts": {
                     "GET": "Lists all shopcarts grouped by user",
                 },
+                "/shopcarts/search": {
+                    "GET": "Searches the item descriptions, best match first",
+                },
+                "/shopcarts/stats": {
+                    "GET": "Summarizes the shopcarts, overall or per user, day, week or month",
+                },
                 "/shopcarts/{user_id}": {
                     "POST": "Adds an item to a user's shopcart or updates quantity if it already exists",
                     "GET": "Retrieves the shopcart with metadata",
@@ -119,6 +141,20 @@ def health():
     return {"status": "OK"}, status.HTTP_200_OK
 
 
+############################################################
+# M E T R I C S   E N D P O I N T
+############################################################
+@app.route("/metrics")
+def metrics():
+    """Returns runtime statistics for the service"""
+    return {
+        "pool": pool_stats(db.engine.pool),
+        "cart_cache": cart_cache.stats(),
+        "filter_cache": filter_cache.stats(),
+        "compression": compression.metrics.stats(),
+    }, status.HTTP_200_OK
+
+
 # Define the models for Swagger documentation
 
 shopcart_item_without_timestamps_model = api.model(
@@ -171,6 +207,37 @@ shopcart_model = api.model(
     },
 )
 
+shopcart_percentiles_model = api.model(
+    "ShopcartPercentiles",
+    {
+        "p50": fields.Float(description="Median"),
+        "p90": fields.Float(description="90th percentile"),
+        "p99": fields.Float(description="99th percentile"),
+    },
+)
+
+shopcart_stats_model = api.model(
+    "ShopcartStats",
+    {
+        "user_id": fields.Integer(description="The user, with group_by=user_id"),
+        "day": fields.Date(description="The creation day, with group_by=day"),
+        "week": fields.Date(description="The first day of the creation week, with group_by=week"),
+        "month": fields.Date(description="The first day of the creation month, with group_by=month"),
+        "carts": fields.Integer(description="Number of carts holding matching items"),
+        "items": fields.Integer(description="Number of matching items"),
+        "units": fields.Integer(description="Total quantity of the matching items"),
+        "value": fields.Float(description="Total price times quantity of the matching items"),
+        "avg_cart_items": fields.Float(description="Average number of matching items per cart"),
+        "avg_cart_value": fields.Float(description="Average value of the matching items per cart"),
+        "cart_items_percentiles": fields.Nested(
+            shopcart_percentiles_model, description="Percentiles of the matching items per cart"
+        ),
+        "cart_value_percentiles": fields.Nested(
+            shopcart_percentiles_model, description="Percentiles of the value per cart"
+        ),
+    },
+)
+
 # Define query string arguments for filtering
 shopcart_args = reqparse.RequestParser()
 shopcart_args.add_argument(
@@ -182,6 +249,12 @@ shopcart_args.add_argument(
 shopcart_args.add_argument(
     "description", type=str, location="args", help="Filter by description"
 )
+shopcart_args.add_argument(
+    "q",
+    type=str,
+    location="args",
+    help="Find items whose description contains this text, in any case",
+)
 shopcart_args.add_argument(
     "quantity",
     type=str,
@@ -224,6 +297,159 @@ shopcart_args.add_argument(
 shopcart_args.add_argument(
     "max-qty", type=int, location="args", help="Filter by maximum quantity"
 )
+shopcart_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    help="Comma-separated item fields to return, e.g. item_id,quantity",
+)
+# The item endpoints only take the fields argument
+shopcart_fields_args = reqparse.RequestParser()
+shopcart_fields_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    help="Comma-separated item fields to return, e.g. item_id,quantity",
+)
+# The list endpoint also takes paging arguments
+shopcart_page_args = shopcart_args.copy()
+shopcart_page_args.add_argument(
+    "limit", type=int, location="args", help="Maximum number of items per page"
+)
+shopcart_page_args.add_argument(
+    "next",
+    type=str,
+    location="args",
+    help="Cursor for the next page, from the X-Next-Cursor header",
+)
+shopcart_page_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    help="Comma-separated fields to sort the items by, '-' for descending, e.g. price,-last_updated",
+)
+shopcart_page_args.add_argument(
+    "format",
+    type=str,
+    location="args",
+    choices=(COLUMNAR_FORMAT,),
+    help="columnar to list the page as one array of values per item field",
+)
+
+# The search endpoint caps its results
+shopcart_search_args = shopcart_args.copy()
+shopcart_search_args.replace_argument(
+    "q",
+    type=str,
+    required=True,
+    location="args",
+    help="Text to find in the item descriptions, in any case",
+)
+shopcart_search_args.add_argument(
+    "limit", type=int, location="args", help="Maximum number of items to return"
+)
+# The stats endpoint takes the filters and a grouping
+shopcart_stats_args = shopcart_args.copy()
+shopcart_stats_args.remove_argument("fields")
+shopcart_stats_args.add_argument(
+    "group_by",
+    type=str,
+    location="args",
+    choices=STATS_GROUPS,
+    help="Summarize per user_id, or per day, week or month of creation",
+)
+
+######################################################################
+#  M A R S H A L L I N G
+######################################################################
+
+
+# Models narrowed to the item fields of a ?fields= request, by model name
+projected_models = {}
+
+
+def item_model_of(model):
+    """Returns the item model of a cart model, or the item model itself"""
+    return model["items"].container.nested if "items" in model else model
+
+
+def project_model(model, names):
+    """Returns a copy of a cart or item model holding only some item fields"""
+    key = (model.name, names)
+    if key not in projected_models:
+        if "items" in model:
+            item_model = project_model(item_model_of(model), names)
+            projection = {
+                "user_id": model["user_id"],
+                "items": fields.List(fields.Nested(item_model)),
+            }
+        else:
+            projection = {name: model[name] for name in names}
+        projected_models[key] = Model(f"{model.name}[{','.join(names)}]", projection)
+    return projected_models[key]
+
+
+def response_mediatype():
+    """Returns the representation flask-restx will answer the request with"""
+    return request.accept_mimetypes.best_match(
+        api.representations, default=api.default_mediatype
+    )
+
+
+def unmarshalled_response(data, code, headers):
+    """Makes the negotiated response for data that has no Swagger model"""
+    if response_mediatype() == "application/json":
+        return make_json_response(data, code, headers)
+    return api.make_response(data, code, headers)
+
+
+def marshal_response(model, as_list=False, code=status.HTTP_200_OK):
+    """Marshals like api.marshal_with, with a few shortcuts
+
+    A handler can return a ready-made Response, such as a streamed one or a
+    304, which is sent as it is. With FAST_JSON set, dictionaries and lists
+    are sent without being marshalled, straight to JSON or to the other
+    negotiated representation, so handlers must return data that already
+    has the shape of the model; requests with an X-Fields mask are still
+    marshalled. A ?fields= request is marshalled
+    with a copy of the model narrowed to those item fields. The Swagger
+    documentation is the same as with api.marshal_with.
+    """
+
+    def decorator(func):
+        marshal_result = api.marshal_with(model, as_list=as_list, code=code)(
+            lambda result: result
+        )
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            if app.config["FAST_JSON"] and not request.headers.get(
+                app.config["RESTX_MASK_HEADER"]
+            ):
+                data, result_code, headers = unpack(result)
+                if isinstance(data, (dict, list)):
+                    if response_mediatype() == "application/json":
+                        return make_json_response(data, result_code, headers)
+                    return data, result_code, headers
+            # The GET handler has already rejected unknown fields
+            if request.method == "GET" and request.args.get("fields"):
+                names = parse_fields(request.args["fields"], tuple(item_model_of(model)))
+                projection = project_model(model, names)
+                return api.marshal_with(projection, as_list=as_list, code=code)(
+                    lambda result: result
+                )(result)
+            return marshal_result(result)
+
+        wrapper.__apidoc__ = merge(
+            getattr(func, "__apidoc__", {}), marshal_result.__apidoc__
+        )
+        return wrapper
+
+    return decorator
+
 
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
@@ -235,15 +461,81 @@ class ShopcartsCollection(Resource):
     """Handles all interactions with collections of Shopcarts"""
 
     @api.doc("list_shopcarts")
-    @api.expect(shopcart_args, validate=False)
-    @api.marshal_list_with(shopcart_model)
+    @api.expect(shopcart_page_args, validate=False)
+    @api.produces([*api.representations, NDJSON_MIMETYPE])
+    @api.response(400, "Invalid filter, limit, sort or cursor")
+    @api.response(413, "More items match than QUERY_ROW_BUDGET allows streaming")
+    @marshal_response(shopcart_model, as_list=True)
     def get(self):
-        """Lists all shopcarts grouped by user"""
+        """Lists all shopcarts grouped by user
+
+        With Accept: application/x-ndjson every matching cart is streamed,
+        one per line, instead of a single page, unless more items match
+        than QUERY_ROW_BUDGET allows. With format=columnar the
+        page is sent as {"columns": [...], "data": [[...], ...]}, one array
+        of values per item field, in (user_id, item_id) order.
+        """
         app.logger.info("Request to list all shopcarts")
-        shopcarts, code = get_shopcarts_controller()
+        if request.args.get("format") == COLUMNAR_FORMAT:
+            columns, code, headers = get_shopcarts_controller()
+            if code != status.HTTP_200_OK:
+                abort(code, columns)
+            return unmarshalled_response(columns, code, headers)
+        best = request.accept_mimetypes.best_match([*api.representations, NDJSON_MIMETYPE])
+        if best == NDJSON_MIMETYPE:
+            stream, code = stream_shopcarts_controller()
+            if code != status.HTTP_200_OK:
+                abort(code, stream)
+            return stream
+        shopcarts, code, headers = get_shopcarts_controller()
         if code != status.HTTP_200_OK:
             abort(code, shopcarts)
-        return shopcarts, code
+        return shopcarts, code, headers
+
+
+@api.route("/shopcarts/search", strict_slashes=False)
+class ShopcartsSearch(Resource):
+    """Handles searches of the shopcart items"""
+
+    @api.doc("search_shopcarts")
+    @api.expect(shopcart_search_args, validate=False)
+    @api.response(400, "Missing or short q, invalid filter, limit or fields")
+    @marshal_response(shopcart_item_model, as_list=True)
+    def get(self):
+        """Searches the item descriptions, best match first
+
+        Returns the items whose description contains q, ignoring case,
+        with the other filters applied. Items are ranked by how similar
+        their description is to q when the database has pg_trgm, and
+        shortest description first otherwise.
+        """
+        items, code = search_shopcarts_controller()
+        if code != status.HTTP_200_OK:
+            abort(code, items)
+        return items, code
+
+
+@api.route("/shopcarts/stats", strict_slashes=False)
+class ShopcartsStats(Resource):
+    """Handles the statistics of the shopcarts"""
+
+    @api.doc("get_shopcart_stats")
+    @api.expect(shopcart_stats_args, validate=False)
+    @api.response(200, "Statistics, a list of them with group_by", shopcart_stats_model)
+    @api.response(400, "Invalid filter or group_by")
+    @api.response(413, "More groups than QUERY_ROW_BUDGET allows")
+    def get(self):
+        """Summarizes the shopcarts holding the matching items
+
+        Returns the number of carts, items and units, the total value and
+        the average and percentiles of the items and value per cart, all
+        computed in the database. With group_by the same statistics are
+        listed per user, or per day, week or month of creation.
+        """
+        stats, code = get_shopcart_stats_controller()
+        if code != status.HTTP_200_OK:
+            abort(code, stats)
+        return unmarshalled_response(stats, code, {})
 
 
 @api.route("/shopcarts/<int:user_id>", strict_slashes=False)
@@ -253,16 +545,21 @@ class ShopcartsResource(Resource):
     @api.doc("get_shopcart")
     @api.expect(shopcart_args, validate=False)
     @api.response(200, "Success")
+    @api.response(304, "Shopcart not modified")
     @api.response(404, "Shopcart not found")
     @api.response(500, "Internal Server Error")
-    @api.marshal_with(shopcart_model)
+    @marshal_response(shopcart_model)
     def get(self, user_id):
         """Gets the shopcart for a specific user id"""
         app.logger.info("Request to get shopcart for user_id: '%s'", user_id)
+        # Filtered reads are different representations and are not tagged
+        etag = None if request.args else cart_etag(user_id, variant="cart")
+        if etag and request.if_none_match.contains(etag):
+            return not_modified(etag)
         shopcart, code = get_user_shopcart_controller(user_id)
         if code != status.HTTP_200_OK:
             abort(code, shopcart)
-        return shopcart, code
+        return shopcart, code, etag_header(etag)
 
     @api.doc("add_to_cart")
     @api.expect(
@@ -280,7 +577,7 @@ class ShopcartsResource(Resource):
             },
         )
     )
-    @api.marshal_list_with(shopcart_item_model, code=201)
+    @marshal_response(shopcart_item_model, as_list=True, code=201)
     @api.response(201, "Item created successfully")
     @api.response(400, "Invalid input")
     @api.response(500, "Internal Server Error")
@@ -328,19 +625,23 @@ class ShopcartsResource(Resource):
     @api.response(200, "Shopcart updated successfully")
     @api.response(400, "Invalid input")
     @api.response(404, "Shopcart or item not found")
-    @api.marshal_list_with(shopcart_item_model)
+    @api.response(412, "Shopcart changed since it was read (If-Match)")
+    @marshal_response(shopcart_item_model, as_list=True)
     def put(self, user_id):
         """Update an existing shopcart"""
         app.logger.info("Request to update shopcart for user_id: '%s'", user_id)
+        check_if_match(user_id, variant="cart")
         shopcart, code, headers = update_shopcart_controller(user_id)
         if code != status.HTTP_200_OK:
             abort(code, shopcart)
         return shopcart, code, headers
 
     @api.doc("delete_shopcart")
+    @api.response(412, "Shopcart changed since it was read (If-Match)")
     def delete(self, user_id):
         """Delete an entire shopcart for a user"""
         app.logger.info("Request to delete shopcart for user_id: '%s'", user_id)
+        check_if_match(user_id, variant="cart")
         return delete_shopcart_controller(user_id)
 
 
@@ -349,17 +650,23 @@ class ShopcartItemsCollection(Resource):
     """Handles all interactions with the items in a specific user's shopcart"""
 
     @api.doc("get_shopcart_items")
+    @api.expect(shopcart_fields_args, validate=False)
     @api.response(200, "Success")
+    @api.response(304, "Items not modified")
     @api.response(404, "User not found")
     @api.response(500, "Internal Server Error")
-    @api.marshal_with(shopcart_items_without_timestamps_model)
+    @marshal_response(shopcart_items_without_timestamps_model)
     def get(self, user_id):
         """Gets all items in a specific user's shopcart"""
         app.logger.info("Request to get all items for user_id: '%s'", user_id)
+        # Narrowed reads are different representations and are not tagged
+        etag = None if request.args else cart_etag(user_id, variant="items")
+        if etag and request.if_none_match.contains(etag):
+            return not_modified(etag)
         shopcart_items, code = get_user_shopcart_items_controller(user_id)
         if code != status.HTTP_200_OK:
             abort(code, shopcart_items)
-        return shopcart_items, code
+        return shopcart_items, code, etag_header(etag)
 
     @api.doc("add_product_to_cart")
     @api.expect(
@@ -386,7 +693,7 @@ class ShopcartItemsCollection(Resource):
     @api.response(201, "Item successfully added")
     @api.response(400, "Invalid input")
     @api.response(500, "Internal Server Error")
-    @api.marshal_list_with(shopcart_item_model, code=201)
+    @marshal_response(shopcart_item_model, as_list=True, code=201)
     def post(self, user_id):
         """Add a product to a user's shopping cart or update quantity if it already exists."""
         app.logger.info("Request to add product to cart for user_id: '%s'", user_id)
@@ -410,17 +717,22 @@ class ShopcartItemsResource(Resource):
     """Handles all interactions with a specific item in a shopcart"""
 
     @api.doc("get_cart_item")
+    @api.expect(shopcart_fields_args, validate=False)
     @api.response(200, "Success")
+    @api.response(304, "Item not modified")
     @api.response(404, "User or item not found")
     @api.response(500, "Internal Server Error")
-    @api.marshal_with(shopcart_item_model)
+    @marshal_response(shopcart_item_model)
     def get(self, user_id, item_id):
         """Gets a specific item from a user's shopcart"""
         app.logger.info("Request to get item %s for user_id: %s", item_id, user_id)
+        etag = None if request.args else cart_etag(user_id, item_id, variant="item")
+        if etag and request.if_none_match.contains(etag):
+            return not_modified(etag)
         cart_item, code = get_cart_item_controller(user_id, item_id)
         if code != status.HTTP_200_OK:
             abort(code, cart_item)
-        return cart_item, code
+        return cart_item, code, etag_header(etag)
 
     @api.doc("update_cart_item")
     @api.expect(
@@ -436,10 +748,12 @@ class ShopcartItemsResource(Resource):
     @api.response(200, "Item updated")
     @api.response(400, "Invalid input")
     @api.response(404, "Item not found")
-    @api.marshal_with(shopcart_item_model)
+    @api.response(412, "Item changed since it was read (If-Match)")
+    @marshal_response(shopcart_item_model)
     def put(self, user_id, item_id):
         """Update a specific item in a user's shopping cart"""
         app.logger.info("Request to update item %s for user_id: %s", item_id, user_id)
+        check_if_match(user_id, item_id, variant="item")
         cart_item, code = update_cart_item_controller(user_id, item_id)
         if code != status.HTTP_200_OK:
             abort(code, cart_item)
@@ -448,12 +762,14 @@ class ShopcartItemsResource(Resource):
     @api.doc("delete_shopcart_item")
     @api.response(204, "Item deleted")
     @api.response(404, "Item not found")
+    @api.response(412, "Item changed since it was read (If-Match)")
     @api.response(500, "Internal Server Error")
     def delete(self, user_id, item_id):
         """Delete a specific item from a user's shopping cart"""
         app.logger.info(
             "Request to delete item %s from user_id: %s shopping cart", item_id, user_id
         )
+        check_if_match(user_id, item_id, variant="item")
         return delete_shopcart_item_controller(user_id, item_id)
 
 
@@ -481,3 +797,40 @@ def abort(error_code: int, message: str):
     """Logs errors before aborting"""
     app.logger.error(message)
     api.abort(error_code, message)
+
+
+def cart_etag(user_id, item_id=None, variant="cart", lock=False):
+    """Returns the ETag of a cart or item representation, or None if missing"""
+    fingerprint = Shopcart.fingerprint(user_id, item_id, lock=lock)
+    if fingerprint is None:
+        return None
+    count, last_updated, digest = fingerprint
+    return f"{variant}-{count}-{last_updated:%Y%m%d%H%M%S%f}-{digest}"
+
+
+def etag_header(etag):
+    """Returns the headers that send an ETag, if there is one"""
+    return {"ETag": quote_etag(etag)} if etag else {}
+
+
+def not_modified(etag):
+    """Returns an empty 304 response for a matching If-None-Match"""
+    response = app.response_class(status=status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+
+def check_if_match(user_id, item_id=None, variant="cart"):
+    """Aborts with 412 if the If-Match header does not match the resource
+
+    The rows are locked while they are compared, so they cannot change
+    before the write that follows in the same transaction.
+    """
+    if not request.if_match:
+        return
+    etag = cart_etag(user_id, item_id, variant=variant, lock=True)
+    if etag is None or not request.if_match.contains(etag):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The resource has changed since it was read",
+        )
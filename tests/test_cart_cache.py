@@ -0,0 +1,174 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the cart cache
+"""
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service.common import status
+from service.common.cart_cache import CartCache, cache
+from service.models import Shopcart
+from tests.factories import ShopcartFactory
+from .test_routes import TestShopcartService
+
+
+class TestCartCache(TestCase):
+    """Test Cases for the CartCache LRU"""
+
+    def test_hit_and_miss(self):
+        """It should load a cart once and then serve it from the cache"""
+        lru = CartCache()
+        loader = MagicMock(return_value=[{"item_id": 1}])
+        self.assertEqual(lru.get_or_load(1, loader), [{"item_id": 1}])
+        self.assertEqual(lru.get_or_load(1, loader), [{"item_id": 1}])
+        self.assertEqual(loader.call_count, 1)
+        stats = lru.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used carts past max_bytes"""
+        lru = CartCache(max_bytes=30)
+        lru.get_or_load(1, lambda: ["a" * 8])
+        lru.get_or_load(2, lambda: ["b" * 8])
+        lru.get_or_load(1, lambda: ["unused"])  # 1 is now the most recent
+        lru.get_or_load(3, lambda: ["c" * 8])
+        stats = lru.stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["entries"], 2)
+        self.assertLessEqual(stats["bytes"], 30)
+        self.assertEqual(lru.get_or_load(1, lambda: ["reloaded"]), ["a" * 8])
+        self.assertEqual(lru.get_or_load(2, lambda: ["reloaded"]), ["reloaded"])
+
+    def test_skips_oversized_carts(self):
+        """It should not cache a cart larger than the whole budget"""
+        lru = CartCache(max_bytes=10)
+        lru.get_or_load(1, lambda: ["x" * 20])
+        self.assertEqual(lru.stats()["entries"], 0)
+
+    def test_ttl(self):
+        """It should expire carts after the TTL"""
+        lru = CartCache(ttl=10)
+        with patch("service.common.cart_cache.time.monotonic", return_value=100.0):
+            lru.get_or_load(1, lambda: ["old"])
+        with patch("service.common.cart_cache.time.monotonic", return_value=105.0):
+            self.assertEqual(lru.get_or_load(1, lambda: ["new"]), ["old"])
+        with patch("service.common.cart_cache.time.monotonic", return_value=111.0):
+            self.assertEqual(lru.get_or_load(1, lambda: ["new"]), ["new"])
+        self.assertEqual(lru.stats()["expirations"], 1)
+
+    def test_disabled(self):
+        """It should always call the loader when disabled"""
+        lru = CartCache(enabled=False)
+        loader = MagicMock(return_value=[])
+        lru.get_or_load(1, loader)
+        lru.get_or_load(1, loader)
+        self.assertEqual(loader.call_count, 2)
+        self.assertEqual(lru.stats()["entries"], 0)
+
+    def test_invalidate_during_load(self):
+        """It should not store a cart that changed while it was loading"""
+        lru = CartCache()
+
+        def loader():
+            lru.invalidate(1)
+            return ["stale"]
+
+        lru.get_or_load(1, loader)
+        self.assertEqual(lru.get_or_load(1, lambda: ["fresh"]), ["fresh"])
+
+    def test_threads(self):
+        """It should keep its accounting consistent under concurrent use"""
+        lru = CartCache(max_bytes=200)
+
+        def worker(offset):
+            for user_id in range(50):
+                lru.get_or_load((user_id + offset) % 20, lambda: ["item"])
+                lru.invalidate(user_id % 7)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = lru.stats()
+        self.assertEqual(stats["hits"] + stats["misses"], 400)
+        self.assertLessEqual(stats["bytes"], 200)
+        self.assertEqual(stats["bytes"], stats["entries"] * len('["item"]'))
+
+
+class TestCartCacheInvalidation(TestShopcartService):
+    """Test Cases for keeping cached carts in step with writes"""
+
+    def _read(self, user_id):
+        resp = self.client.get(f"/api/shopcarts/{user_id}")
+        if resp.status_code != status.HTTP_200_OK:
+            return []
+        return resp.get_json()[0]["items"]
+
+    def test_reads_are_cached(self):
+        """It should serve repeated cart reads from the cache"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._read(1)
+        with patch(
+            "service.models.Shopcart.find_rows_by_user_id",
+            side_effect=Exception("Database error"),
+        ):
+            self.assertEqual(len(self._read(1)), 2)
+            resp = self.client.get("/api/shopcarts/1/items")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotIn("created_at", resp.get_json()[0]["items"][0])
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertIn("created_at", self._read(1)[0])
+
+    def test_writes_invalidate(self):
+        """It should drop a cached cart on create, update, delete and checkout"""
+        shopcart = ShopcartFactory(user_id=1)
+        shopcart.create()
+        self.assertEqual(len(self._read(1)), 1)
+
+        ShopcartFactory(user_id=1).create()
+        self.assertEqual(len(self._read(1)), 2)
+
+        shopcart.quantity = 42
+        shopcart.update()
+        quantities = [item["quantity"] for item in self._read(1)]
+        self.assertIn(42, quantities)
+
+        shopcart.delete()
+        self.assertEqual(len(self._read(1)), 1)
+
+        self.client.post("/api/shopcarts/1/checkout")
+        self.assertEqual(self._read(1), [])
+
+    def test_batch_invalidates_on_commit(self):
+        """It should drop the carts changed in a batch when it commits"""
+        self._read(1)
+        with Shopcart.batch():
+            ShopcartFactory(user_id=1).create()
+            self.assertEqual(self._read(1), [])
+        self.assertEqual(len(self._read(1)), 1)
+
+    def test_metrics(self):
+        """It should report the cache counters in /metrics"""
+        self._populate_shopcarts(count=1, user_id=1)
+        self._read(1)
+        self._read(1)
+        stats = self.client.get("/metrics").get_json()["cart_cache"]
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["entries"], 1)
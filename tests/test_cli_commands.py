@@ -26,7 +26,8 @@ from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service.common.cli_commands import db_create, db_migrate  # noqa: E402
+from service.models import RETIRED_INDEXES, TRIGRAM_INDEX  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -42,3 +43,22 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch("service.common.cli_commands.drop_indexes")
+    @patch("service.common.cli_commands.create_trigram_index")
+    @patch("service.common.cli_commands.create_indexes")
+    @patch("service.common.cli_commands.db")
+    def test_db_migrate(self, db_mock, create_indexes_mock, create_trigram_index_mock, drop_indexes_mock):
+        """It should call the db-migrate command"""
+        create_indexes_mock.return_value = ["ix_shopcart_item_id_sort"]
+        create_trigram_index_mock.return_value = True
+        drop_indexes_mock.return_value = ["ix_shopcart_item_id"]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_migrate)
+            self.assertEqual(result.exit_code, 0)
+        db_mock.create_all.assert_called_once()
+        create_indexes_mock.assert_called_once()
+        create_trigram_index_mock.assert_called_once_with(
+            db_mock.engine, "shopcart", "description", TRIGRAM_INDEX
+        )
+        drop_indexes_mock.assert_called_once_with(db_mock.engine, RETIRED_INDEXES)
@@ -0,0 +1,114 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for columnar listings with ?format=columnar
+"""
+
+# pylint: disable=duplicate-code
+from unittest import TestCase
+from wsgi import app
+from service.common import status
+from service.common.helpers import NDJSON_MIMETYPE, decode_columnar, parse_format
+from service.models import ITEM_FIELDS
+from .test_routes import TestShopcartService
+
+
+class TestColumnarHelpers(TestCase):
+    """Test cases for the columnar helpers"""
+
+    def test_parse_format(self):
+        """It should only accept the columnar format"""
+        self.assertIsNone(parse_format(None))
+        self.assertEqual(parse_format("columnar"), "columnar")
+        self.assertRaises(ValueError, parse_format, "rows")
+
+    def test_decode_columnar(self):
+        """It should turn columns back into items"""
+        page = {"columns": ["item_id", "quantity"], "data": [[1, 2], [5, 7]]}
+        self.assertEqual(
+            decode_columnar(page),
+            [{"item_id": 1, "quantity": 5}, {"item_id": 2, "quantity": 7}],
+        )
+        self.assertEqual(decode_columnar({"columns": ["item_id"], "data": [[]]}), [])
+
+
+class TestColumnarListing(TestShopcartService):
+    """Test cases for GET /api/shopcarts?format=columnar"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, FAST_JSON=False)
+
+    @staticmethod
+    def _items(carts):
+        """Flattens a list of carts into their items"""
+        return [item for cart in carts for item in cart["items"]]
+
+    def test_columnar_matches_carts(self):
+        """It should hold the same items as the cart listing"""
+        self._populate_shopcarts(count=3, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        for fast_json in (False, True):
+            app.config["FAST_JSON"] = fast_json
+            for query in ("", "&fields=item_id,price", "&user_id=2"):
+                carts = self.client.get(f"/api/shopcarts?limit=10{query}").get_json()
+                resp = self.client.get(f"/api/shopcarts?format=columnar&limit=10{query}")
+                self.assertEqual(resp.status_code, status.HTTP_200_OK, query)
+                page = resp.get_json()
+                self.assertEqual(set(page), {"columns", "data"})
+                self.assertEqual(len(page["columns"]), len(page["data"]))
+                self.assertEqual(decode_columnar(page), self._items(carts), query)
+        self.assertEqual(page["columns"], list(ITEM_FIELDS))
+
+    def test_columnar_pages(self):
+        """It should page through every item with the same cursors"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1)
+        shopcarts += self._populate_shopcarts(count=2, user_id=2)
+        expected = sorted((s.user_id, s.item_id) for s in shopcarts)
+
+        keys, pages, cursor = [], 0, None
+        while True:
+            url = "/api/shopcarts?format=columnar&limit=2&fields=user_id,item_id"
+            if cursor:
+                url += f"&next={cursor}"
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages += 1
+            user_ids, item_ids = resp.get_json()["data"]
+            keys.extend(zip(user_ids, item_ids))
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        self.assertEqual(keys, expected)
+        self.assertEqual(pages, 3)
+
+    def test_columnar_empty(self):
+        """It should send empty columns when nothing matches"""
+        resp = self.client.get("/api/shopcarts?format=columnar&fields=quantity")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"columns": ["quantity"], "data": [[]]})
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_columnar_errors(self):
+        """It should reject unknown formats and bad arguments with 400"""
+        for query in ("format=rows", "format=columnar&fields=secret", "format=columnar&limit=0"):
+            resp = self.client.get(f"/api/shopcarts?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+        resp = self.client.get(
+            "/api/shopcarts?format=rows", headers={"Accept": NDJSON_MIMETYPE}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
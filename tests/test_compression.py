@@ -0,0 +1,143 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for response compression
+"""
+
+# pylint: disable=duplicate-code
+import gzip
+import json
+import zlib
+from wsgi import app
+from service.common import status
+from service.common.compression import compress_response, metrics
+from service.common.helpers import NDJSON_MIMETYPE
+from .test_routes import TestShopcartService
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+class TestCompression(TestShopcartService):
+    """Test cases for compressed responses"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+        self.addCleanup(
+            app.config.update, COMPRESS_ENABLED=True, COMPRESS_MIN_SIZE=1024
+        )
+
+    def test_gzip_list(self):
+        """It should gzip a large list for a client that accepts it"""
+        self._populate_shopcarts(count=10, user_id=1)
+        plain = self.client.get("/api/shopcarts")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        resp = self.client.get("/api/shopcarts", headers=GZIP)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data))
+
+        counters = metrics.stats()["encodings"]["gzip"]
+        self.assertEqual(counters["responses"], 1)
+        self.assertEqual(counters["bytes_in"], len(plain.data))
+        self.assertEqual(counters["bytes_out"], len(resp.data))
+        self.assertLess(counters["ratio"], 1)
+        self.assertGreater(counters["compress_time_avg"], 0)
+
+    def test_small_responses(self):
+        """It should send bodies under the minimum size uncompressed"""
+        self._populate_shopcarts(count=1, user_id=1)
+        resp = self.client.get("/api/shopcarts/1", headers=GZIP)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(metrics.stats()["skipped_small"], 1)
+
+        app.config["COMPRESS_MIN_SIZE"] = 0
+        resp = self.client.get("/api/shopcarts/1", headers=GZIP)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(resp.data))[0]["user_id"], 1)
+
+    def test_not_compressed(self):
+        """It should leave empty, disabled and refused responses alone"""
+        self._populate_shopcarts(count=10, user_id=1)
+        app.config["COMPRESS_MIN_SIZE"] = 0
+        etag = self.client.get("/api/shopcarts/1").headers["ETag"]
+        resp = self.client.get(
+            "/api/shopcarts/1", headers={"If-None-Match": etag, **GZIP}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        resp = self.client.get("/api/shopcarts", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        resp = self.client.get("/", headers=GZIP)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp.close()
+
+        app.config["COMPRESS_ENABLED"] = False
+        resp = self.client.get("/api/shopcarts", headers=GZIP)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(metrics.stats()["encodings"], {})
+
+    def test_gzip_stream(self):
+        """It should compress a stream with every line flushed on its own"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        resp = self.client.get(
+            "/api/shopcarts",
+            headers={"Accept": NDJSON_MIMETYPE, **GZIP},
+            buffered=False,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        lines = []
+        for chunk in resp.response:
+            data = decompressor.decompress(chunk)
+            # Each chunk holds whole lines
+            self.assertTrue(not data or data.endswith(b"\n"))
+            lines.extend(data.splitlines())
+        resp.close()
+        self.assertTrue(decompressor.eof)
+        self.assertEqual([json.loads(line)["user_id"] for line in lines], [1, 2])
+        self.assertEqual(metrics.stats()["encodings"]["gzip"]["responses"], 1)
+
+    def test_metrics(self):
+        """It should report the compression counters in /metrics"""
+        resp = self.client.get("/metrics")
+        self.assertEqual(
+            resp.get_json()["compression"], {"skipped_small": 0, "encodings": {}}
+        )
+
+    def test_no_transform(self):
+        """It should not compress a response marked no-transform"""
+        with app.test_request_context(headers=GZIP):
+            response = app.response_class(
+                b"x" * 2048, mimetype="text/plain", headers={"Cache-Control": "no-transform"}
+            )
+            compress_response(response, app.config)
+            self.assertNotIn("Content-Encoding", response.headers)
+            response.headers["Cache-Control"] = "no-cache"
+            compress_response(response, app.config)
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
@@ -0,0 +1,117 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for conditional requests (ETag, If-None-Match and If-Match)
+"""
+
+# pylint: disable=duplicate-code
+from unittest.mock import patch
+from service.common import status
+from .test_routes import TestShopcartService
+
+
+class TestConditionalRequests(TestShopcartService):
+    """Test cases for ETags and preconditions"""
+
+    def test_cart_etag(self):
+        """It should tag a cart and answer a matching poll with 304"""
+        self._populate_shopcarts(count=2, user_id=1)
+        resp = self.client.get("/api/shopcarts/1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        self.assertEqual(self.client.get("/api/shopcarts/1").headers["ETag"], etag)
+
+        with patch(
+            "service.models.Shopcart.find_rows_by_user_id",
+            side_effect=Exception("should not be read"),
+        ):
+            resp = self.client.get("/api/shopcarts/1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+    def test_cart_etag_changes(self):
+        """It should change the ETag when the cart changes"""
+        shopcarts = self._populate_shopcarts(count=2, user_id=1)
+        etag = self.client.get("/api/shopcarts/1").headers["ETag"]
+        self.client.put(
+            f"/api/shopcarts/1/items/{shopcarts[0].item_id}",
+            json={"quantity": shopcarts[0].quantity + 1},
+        )
+        resp = self.client.get("/api/shopcarts/1", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_representations_have_own_etags(self):
+        """It should tag the cart, its item list and each item differently"""
+        shopcarts = self._populate_shopcarts(count=1, user_id=1)
+        item_id = shopcarts[0].item_id
+        etags = {
+            self.client.get("/api/shopcarts/1").headers["ETag"],
+            self.client.get("/api/shopcarts/1/items").headers["ETag"],
+            self.client.get(f"/api/shopcarts/1/items/{item_id}").headers["ETag"],
+        }
+        self.assertEqual(len(etags), 3)
+
+        for url in ("/api/shopcarts/1/items", f"/api/shopcarts/1/items/{item_id}"):
+            etag = self.client.get(url).headers["ETag"]
+            resp = self.client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_no_etag(self):
+        """It should not tag filtered reads or missing carts"""
+        self._populate_shopcarts(count=1, user_id=1, quantity=5)
+        resp = self.client.get("/api/shopcarts/1?quantity=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("ETag", resp.headers)
+        resp = self.client.get("/api/shopcarts/2", headers={"If-None-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_put_if_match(self):
+        """It should only update a cart that still matches If-Match"""
+        shopcarts = self._populate_shopcarts(count=1, user_id=1)
+        etag = self.client.get("/api/shopcarts/1").headers["ETag"]
+        payload = {"items": [{"item_id": shopcarts[0].item_id, "quantity": 7}]}
+
+        resp = self.client.put(
+            "/api/shopcarts/1", json=payload, headers={"If-Match": '"stale"'}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        resp = self.client.put("/api/shopcarts/1", json=payload, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+        # The cart has changed, so the old tag no longer matches
+        resp = self.client.put("/api/shopcarts/1", json=payload, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_delete_if_match(self):
+        """It should honor If-Match when deleting carts and items"""
+        shopcarts = self._populate_shopcarts(count=2, user_id=1)
+        item_url = f"/api/shopcarts/1/items/{shopcarts[0].item_id}"
+        resp = self.client.delete(item_url, headers={"If-Match": '"stale"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        etag = self.client.get(item_url).headers["ETag"]
+        resp = self.client.delete(item_url, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+        resp = self.client.delete("/api/shopcarts/1", headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        # An If-Match on a cart that does not exist can never match
+        resp = self.client.delete("/api/shopcarts/1", headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
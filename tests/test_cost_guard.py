@@ -0,0 +1,106 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the row budget of unpaged collection reads
+"""
+
+# pylint: disable=duplicate-code
+import json
+from unittest.mock import patch
+from wsgi import app
+from service.common import status
+from service.common.helpers import NDJSON_MIMETYPE
+from service.models import Shopcart, QueryTooLargeError
+from .test_routes import TestShopcartService
+
+NDJSON = {"Accept": NDJSON_MIMETYPE}
+
+
+class TestCostGuard(TestShopcartService):
+    """Test cases for QUERY_ROW_BUDGET"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, QUERY_ROW_BUDGET=app.config["QUERY_ROW_BUDGET"])
+        app.config["QUERY_ROW_BUDGET"] = 3
+
+    def test_stream_over_budget(self):
+        """It should refuse to stream more items than the budget with 413"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            resp = self.client.get("/api/shopcarts", headers=NDJSON)
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("limit and next", resp.get_json()["message"])
+        self.assertIn("filtered by nothing", "\n".join(logs.output))
+
+        with self.assertLogs("flask.app", "WARNING") as logs:
+            resp = self.client.get("/api/shopcarts?quantity=~gt~0", headers=NDJSON)
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("['quantity gt']", "\n".join(logs.output))
+
+        # The paged listing is bounded by its limit
+        resp = self.client.get("/api/shopcarts")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_stream_within_budget(self):
+        """It should stream a narrowed or unguarded result"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        resp = self.client.get("/api/shopcarts?user_id=2", headers=NDJSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(resp.data)["items"]), 2)
+
+        app.config["QUERY_ROW_BUDGET"] = 0
+        resp = self.client.get("/api/shopcarts", headers=NDJSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data.splitlines()), 2)
+
+    def test_stats_over_budget(self):
+        """It should refuse to list more groups than the budget with 413"""
+        for user_id in range(1, 5):
+            self._populate_shopcarts(count=1, user_id=user_id)
+        resp = self.client.get("/api/shopcarts/stats?group_by=user_id")
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertIn("groups", resp.get_json()["message"])
+        for url in ("/api/shopcarts/stats", "/api/shopcarts/stats?group_by=month"):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK, url)
+
+    def test_budget_is_exact(self):
+        """It should count the rows rather than trust the planner's estimate"""
+        self._populate_shopcarts(count=4, user_id=1)
+        with patch.object(Shopcart, "_estimate_rows", return_value=10**6):
+            self.assertEqual(len(list(Shopcart.stream(max_rows=4))), 4)
+            with self.assertRaises(QueryTooLargeError) as raised:
+                Shopcart.stream(max_rows=3)
+            self.assertEqual(raised.exception.estimate, 10**6)
+        with patch.object(Shopcart, "_estimate_rows", return_value=1):
+            with self.assertRaises(QueryTooLargeError) as raised:
+                Shopcart.stream({"item_id": {"operator": "gt", "value": "0"}}, max_rows=3)
+            self.assertEqual(raised.exception.estimate, 4)
+
+    def test_estimate_rows(self):
+        """It should read the planner's row estimate"""
+        self._populate_shopcarts(count=2, user_id=1)
+        shape, params = Shopcart._compile_filters({"user_id": {"operator": "eq", "value": "1"}})
+        stmt = Shopcart._filter_statement(
+            ("rows", None), shape, lambda conditions: Shopcart._select_fields().where(*conditions)
+        )
+        estimate = Shopcart._estimate_rows(("rows", None), shape, stmt, params)
+        self.assertIsInstance(estimate, int)
+        self.assertGreaterEqual(estimate, 1)
@@ -70,7 +70,7 @@ class TestShopcartDelete(TestShopcartService):
 
         # Mock the database query to raise an exception
         with patch(
-            "service.models.Shopcart.find_by_user_id",
+            "service.models.Shopcart.delete_by_user_id",
             side_effect=Exception("Database error"),
         ):
             response = self.client.delete(f"/api/shopcarts/{user_id}")
@@ -0,0 +1,80 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the fast JSON response path
+"""
+
+# pylint: disable=duplicate-code
+from wsgi import app
+from service.common import status
+from service.common.fast_json import dumps
+from .test_routes import TestShopcartService
+
+
+class TestFastJson(TestShopcartService):
+    """Test cases for FAST_JSON responses"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, FAST_JSON=False)
+
+    def _get_both_ways(self, url, **kwargs):
+        """Returns the responses to a GET with FAST_JSON off and on"""
+        app.config["FAST_JSON"] = False
+        marshalled = self.client.get(url, **kwargs)
+        app.config["FAST_JSON"] = True
+        fast = self.client.get(url, **kwargs)
+        return marshalled, fast
+
+    def test_dumps(self):
+        """It should encode compact JSON bytes"""
+        self.assertEqual(dumps({"a": [1, 2.5, "x"]}), b'{"a":[1,2.5,"x"]}')
+
+    def test_same_payloads(self):
+        """It should return the same data as the marshalled responses"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1)
+        item_id = shopcarts[0].item_id
+        for url in (
+            "/api/shopcarts",
+            "/api/shopcarts/1",
+            "/api/shopcarts/1/items",
+            f"/api/shopcarts/1/items/{item_id}",
+        ):
+            marshalled, fast = self._get_both_ways(url)
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.mimetype, "application/json")
+            self.assertEqual(fast.get_json(), marshalled.get_json(), url)
+            self.assertEqual(fast.headers.get("ETag"), marshalled.headers.get("ETag"))
+
+    def test_created_response(self):
+        """It should keep the status code and headers of a POST"""
+        app.config["FAST_JSON"] = True
+        resp = self.client.post(
+            "/api/shopcarts/1",
+            json={"item_id": 1, "description": "Pen", "price": 1.5, "quantity": 2},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertIn("Location", resp.headers)
+        self.assertEqual(resp.get_json()[0]["price"], 1.5)
+
+    def test_mask_is_marshalled(self):
+        """It should still marshal requests that send an X-Fields mask"""
+        self._populate_shopcarts(count=1, user_id=1)
+        headers = {"X-Fields": "user_id"}
+        marshalled, fast = self._get_both_ways("/api/shopcarts/1", headers=headers)
+        self.assertEqual(fast.get_json(), [{"user_id": 1}])
+        self.assertEqual(fast.get_json(), marshalled.get_json())
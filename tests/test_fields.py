@@ -0,0 +1,163 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for sparse field projection with ?fields=
+"""
+
+# pylint: disable=duplicate-code
+import json
+from unittest import TestCase
+from sqlalchemy import event
+from wsgi import app
+from service.common import status
+from service.common.helpers import NDJSON_MIMETYPE, parse_fields
+from service.models import db
+from .test_routes import TestShopcartService
+
+
+class TestParseFields(TestCase):
+    """Test cases for parsing the fields parameter"""
+
+    def test_parse_fields(self):
+        """It should return known fields in column order without duplicates"""
+        self.assertIsNone(parse_fields(None))
+        self.assertEqual(
+            parse_fields("quantity, item_id,quantity"), ("item_id", "quantity")
+        )
+        self.assertRaises(ValueError, parse_fields, "quantity,secret")
+        self.assertRaises(ValueError, parse_fields, " , ")
+        self.assertRaises(ValueError, parse_fields, "price", allowed=("item_id",))
+
+
+class TestFieldProjection(TestShopcartService):
+    """Test cases for GET requests narrowed with ?fields="""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, FAST_JSON=False)
+
+    def _record_statements(self):
+        """Returns a list that collects the SQL sent for the rest of the test"""
+        statements = []
+
+        def record(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", record)
+        return statements
+
+    def test_fields_on_every_get(self):
+        """It should return only the requested item fields"""
+        shopcarts = self._populate_shopcarts(count=2, user_id=1)
+        item_id = shopcarts[0].item_id
+        for fast_json in (False, True):
+            app.config["FAST_JSON"] = fast_json
+            for url in (
+                "/api/shopcarts",
+                "/api/shopcarts/1",
+                "/api/shopcarts/1/items",
+            ):
+                resp = self.client.get(url, query_string={"fields": "quantity,item_id"})
+                self.assertEqual(resp.status_code, status.HTTP_200_OK, url)
+                carts = resp.get_json()
+                self.assertEqual(list(carts[0]), ["user_id", "items"])
+                for item in carts[0]["items"]:
+                    self.assertEqual(set(item), {"item_id", "quantity"}, url)
+
+            resp = self.client.get(
+                f"/api/shopcarts/1/items/{item_id}", query_string={"fields": "price"}
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), {"price": float(shopcarts[0].price)})
+
+    def test_fields_match_full_items(self):
+        """It should return the same values as the full representation"""
+        self._populate_shopcarts(count=3, user_id=1)
+        full = self.client.get("/api/shopcarts/1").get_json()[0]["items"]
+        narrowed = self.client.get(
+            "/api/shopcarts/1", query_string={"fields": "item_id,created_at,price"}
+        ).get_json()[0]["items"]
+        self.assertEqual(
+            narrowed,
+            [
+                {key: item[key] for key in ("item_id", "created_at", "price")}
+                for item in full
+            ],
+        )
+
+    def test_fields_narrow_select(self):
+        """It should leave unrequested columns out of the query"""
+        self._populate_shopcarts(count=1, user_id=1)
+        statements = self._record_statements()
+        resp = self.client.get("/api/shopcarts/1/items?fields=quantity")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        reads = [sql for sql in statements if "shopcart.quantity" in sql]
+        self.assertEqual(len(reads), 1)
+        self.assertNotIn("description", reads[0])
+
+    def test_fields_stream(self):
+        """It should stream carts with only the requested item fields"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._populate_shopcarts(count=1, user_id=2)
+        resp = self.client.get(
+            "/api/shopcarts?fields=item_id", headers={"Accept": NDJSON_MIMETYPE}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        carts = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual([cart["user_id"] for cart in carts], [1, 2])
+        for cart in carts:
+            for item in cart["items"]:
+                self.assertEqual(list(item), ["item_id"])
+
+    def test_fields_not_tagged(self):
+        """It should not send an ETag for a narrowed representation"""
+        shopcarts = self._populate_shopcarts(count=1, user_id=1)
+        for url in (
+            "/api/shopcarts/1/items?fields=quantity",
+            f"/api/shopcarts/1/items/{shopcarts[0].item_id}?fields=quantity",
+        ):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertNotIn("ETag", resp.headers)
+
+    def test_bad_fields(self):
+        """It should reject unknown fields with 400"""
+        self._populate_shopcarts(count=1, user_id=1)
+        for url in (
+            "/api/shopcarts?fields=secret",
+            "/api/shopcarts/1?fields=secret",
+            "/api/shopcarts/1/items?fields=created_at",
+            "/api/shopcarts/1/items/1?fields=",
+        ):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, url)
+        resp = self.client.get(
+            "/api/shopcarts?fields=secret", headers={"Accept": NDJSON_MIMETYPE}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fields_missing_cart(self):
+        """It should return 404 for a narrowed read of a missing cart or item"""
+        shopcarts = self._populate_shopcarts(count=1, user_id=1)
+        for url in (
+            "/api/shopcarts/2/items?fields=quantity",
+            "/api/shopcarts/2/items/1?fields=quantity",
+            f"/api/shopcarts/1/items/{shopcarts[0].item_id + 1}?fields=quantity",
+        ):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND, url)
@@ -0,0 +1,142 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the compiled filter cache
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock
+from sqlalchemy import event
+from service.common import status
+from service.common.filter_cache import FilterCache, cache
+from service.models import Shopcart, db
+from .test_routes import TestShopcartService
+
+
+class TestFilterCache(TestCase):
+    """Test Cases for the FilterCache LRU"""
+
+    def test_hit_and_miss(self):
+        """It should build an entry once and count hits per kind"""
+        lru = FilterCache()
+        build = MagicMock(return_value="stmt")
+        self.assertEqual(lru.get_or_build(("statements", 1), build), "stmt")
+        self.assertEqual(lru.get_or_build(("statements", 1), build), "stmt")
+        lru.get_or_build(("filters", 1), lambda: "compiled")
+        self.assertEqual(build.call_count, 1)
+        stats = lru.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(
+            stats["kinds"]["statements"], {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+        )
+        self.assertEqual(stats["kinds"]["filters"]["hit_ratio"], 0.0)
+
+    def test_evicts_least_recently_used(self):
+        """It should evict the least recently used entries past max_entries"""
+        lru = FilterCache(max_entries=2)
+        lru.get_or_build(("filters", 1), lambda: "a")
+        lru.get_or_build(("filters", 2), lambda: "b")
+        lru.get_or_build(("filters", 1), lambda: "unused")  # 1 is now the most recent
+        lru.get_or_build(("filters", 3), lambda: "c")
+        self.assertEqual(lru.stats()["evictions"], 1)
+        self.assertEqual(lru.get_or_build(("filters", 1), lambda: "rebuilt"), "a")
+        self.assertEqual(lru.get_or_build(("filters", 2), lambda: "rebuilt"), "rebuilt")
+
+    def test_errors_and_disabled(self):
+        """It should not cache failed builds, nor anything when disabled"""
+        lru = FilterCache()
+        build = MagicMock(side_effect=ValueError("bad"))
+        self.assertRaises(ValueError, lru.get_or_build, ("filters", 1), build)
+        self.assertEqual(lru.stats()["entries"], 0)
+
+        lru.configure(max_entries=10, enabled=False)
+        build = MagicMock(return_value="stmt")
+        lru.get_or_build(("statements", 1), build)
+        lru.get_or_build(("statements", 1), build)
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(lru.stats()["kinds"], {})
+
+
+class TestCompiledFilters(TestShopcartService):
+    """Test cases for filtered reads through the filter cache"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def _record_statements(self):
+        """Returns a list that collects the SQL sent for the rest of the test"""
+        statements = []
+
+        def record(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", record)
+        return statements
+
+    def test_repeated_filters_hit(self):
+        """It should compile a repeated filter and its statement only once"""
+        self._populate_shopcarts(count=2, user_id=1)
+        for _ in range(3):
+            resp = self.client.get("/api/shopcarts?user_id=1&quantity=~gt~0")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(resp.get_json()[0]["items"]), 2)
+        kinds = cache.stats()["kinds"]
+        self.assertEqual(kinds["filters"], {"hits": 2, "misses": 1, "hit_ratio": 2 / 3})
+        self.assertEqual(kinds["statements"]["misses"], 1)
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.get_json()["filter_cache"]["kinds"], cache.stats()["kinds"])
+
+    def test_in_lists_share_sql(self):
+        """It should send the same SQL for in lists of any length"""
+        self._populate_shopcarts(count=1, user_id=1)
+        self._populate_shopcarts(count=1, user_id=2)
+        statements = self._record_statements()
+        for user_ids, count in (("1,2", 2), ("1,2,3", 2), ("2,4,6,8", 1)):
+            resp = self.client.get(f"/api/shopcarts?user_id={user_ids}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(resp.get_json()), count)
+        self.assertEqual(len(set(statements)), 1)
+        self.assertIn("= ANY", statements[0])
+        self.assertEqual(cache.stats()["kinds"]["statements"]["misses"], 1)
+
+    def test_shapes_and_values(self):
+        """It should share statements between values but not between shapes"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1, price=10.0)
+        prices = [float(shopcart.price) for shopcart in shopcarts]
+        for operator, expected in (("lt", 0), ("lte", 3), ("gte", 3), ("gt", 0)):
+            filters = {"price": {"operator": operator, "value": "10.0"}}
+            self.assertEqual(len(Shopcart.find_rows_with_filter(filters)), expected, operator)
+        filters = {"price": {"operator": "in", "value": [str(prices[0]), "99.5"]}}
+        self.assertEqual(len(Shopcart.find_rows_with_filter(filters)), 3)
+        filters = {"price": {"operator": "range", "value": ["5", "20"]}}
+        self.assertEqual(len(Shopcart.find_rows_with_filter(filters)), 3)
+        # One statement per operator
+        self.assertEqual(cache.stats()["kinds"]["statements"]["misses"], 6)
+
+    def test_invalid_filters(self):
+        """It should reject malformed filters without caching them"""
+        for filters in (
+            {"user_id": {"operator": "in", "value": "1"}},
+            {"user_id": {"operator": "range", "value": ["1", "2", "3"]}},
+            {"user_id": {"operator": "range", "value": ["2", "1"]}},
+            {"user_id": {"operator": "like", "value": "1"}},
+            {"user_id": {"operator": "eq", "value": "one"}},
+        ):
+            self.assertRaises(ValueError, Shopcart.find_rows_with_filter, filters)
+        self.assertEqual(cache.stats()["entries"], 0)
@@ -20,7 +20,10 @@ TestYourResourceModel API Service Test Suite
 """
 
 # pylint: disable=duplicate-code
+import json
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
+from wsgi import app
 from service.common import status
 from .test_routes import TestShopcartService
 
@@ -57,6 +60,12 @@ class TestShopcartGet(TestShopcartService):
             "/shopcarts": {
                 "GET": "Lists all shopcarts grouped by user",
             },
+            "/shopcarts/search": {
+                "GET": "Searches the item descriptions, best match first",
+            },
+            "/shopcarts/stats": {
+                "GET": "Summarizes the shopcarts, overall or per user, day, week or month",
+            },
             "/shopcarts/{user_id}": {
                 "POST": "Adds an item to a user's shopcart or updates quantity if it already exists",
                 "GET": "Retrieves the shopcart with metadata",
@@ -87,6 +96,14 @@ class TestShopcartGet(TestShopcartService):
         self.assertIn("status", data)
         self.assertEqual(data["status"], "OK")
 
+    def test_metrics_endpoint(self):
+        """It should return connection pool statistics"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pool = response.get_json()["pool"]
+        for key in ["size", "checked_out", "overflow", "checkout_timeouts"]:
+            self.assertIn(key, pool)
+
     def test_list_shopcarts(self):
         """It should list all shopcarts in the database"""
         # Create test data
@@ -137,6 +154,59 @@ class TestShopcartGet(TestShopcartService):
         data = resp.get_json()
         self.assertEqual(data, [])
 
+    def test_stream_shopcarts_ndjson(self):
+        """It should stream one cart per line when asked for NDJSON"""
+        self._populate_shopcarts(count=3, user_id=1, quantity=5)
+        self._populate_shopcarts(count=2, user_id=2, quantity=5)
+        self._populate_shopcarts(count=1, user_id=2, quantity=9)
+
+        resp = self.client.get(
+            "/api/shopcarts?quantity=5", headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        carts = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([cart["user_id"] for cart in carts], [1, 2])
+        self.assertEqual([len(cart["items"]) for cart in carts], [3, 2])
+        for cart in carts:
+            item_ids = [item["item_id"] for item in cart["items"]]
+            self.assertEqual(item_ids, sorted(item_ids))
+
+    def test_stream_shopcarts_in_batches(self):
+        """It should keep streaming after the request's app context is gone"""
+        self._populate_shopcarts(count=3, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        app.config["STREAM_BATCH_SIZE"] = 2
+        self.addCleanup(app.config.update, STREAM_BATCH_SIZE=1000)
+
+        def read_stream():
+            resp = self.client.get(
+                "/api/shopcarts", headers={"Accept": "application/x-ndjson"}
+            )
+            return resp.status_code, resp.get_data(as_text=True)
+
+        # A new thread has no app context, like a request in production
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            code, data = executor.submit(read_stream).result()
+        self.assertEqual(code, status.HTTP_200_OK)
+        carts = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual([len(cart["items"]) for cart in carts], [3, 2])
+
+    def test_stream_shopcarts_bad_filter(self):
+        """It should return 400 before streaming when a filter is invalid"""
+        resp = self.client.get(
+            "/api/shopcarts?quantity=abc", headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_shopcarts_documents_model(self):
+        """It should still document the list response model in Swagger"""
+        resp = self.client.get("/api/swagger.json")
+        operation = resp.get_json()["paths"]["/shopcarts"]["get"]
+        self.assertIn("application/x-ndjson", operation["produces"])
+        schema = operation["responses"]["200"]["schema"]
+        self.assertEqual(schema["items"]["$ref"], "#/definitions/ShopCart")
+
     def test_read_user_shopcart(self):
         """It should get the shopcarts"""
         shopcart_user_1 = self._populate_shopcarts(count=3, user_id=1)
@@ -238,7 +308,7 @@ class TestShopcartGet(TestShopcartService):
         """Read by user_id should handle server errors gracefully"""
         self._populate_shopcarts(count=1, user_id=1)
         with patch(
-            "service.models.Shopcart.find_by_user_id",
+            "service.models.Shopcart.find_rows_by_user_id",
             side_effect=Exception("Database error"),
         ):
             resp = self.client.get("/api/shopcarts/1")
@@ -317,7 +387,7 @@ class TestShopcartGet(TestShopcartService):
 
         # Mock the database query to raise an exception with a specific message
         with patch(
-            "service.models.Shopcart.find_by_user_id",
+            "service.models.Shopcart.find_rows_by_user_id",
             side_effect=Exception("Database error"),
         ):
             resp = self.client.get("/api/shopcarts/1/items")
@@ -383,7 +453,8 @@ class TestShopcartGet(TestShopcartService):
 
         # Mock the database query to raise an exception with a specific message
         with patch(
-            "service.models.Shopcart.find", side_effect=Exception("Database error")
+            "service.models.Shopcart.find_rows_by_user_id",
+            side_effect=Exception("Database error"),
         ):
             response = self.client.get(f"/api/shopcarts/{user_id}/items/{item_id}")
 
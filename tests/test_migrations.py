@@ -0,0 +1,75 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the online schema migrations
+"""
+from unittest import TestCase
+from sqlalchemy import inspect, text
+from wsgi import app
+from service.models import db, Shopcart
+from service.common.migrations import concurrent_index_ddl, create_indexes, drop_indexes
+
+
+class TestMigrations(TestCase):
+    """Test Cases for building indexes online"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.app_context().push()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def _index_names(self):
+        return {index["name"] for index in inspect(db.engine).get_indexes("shopcart")}
+
+    def test_concurrent_index_ddl(self):
+        """It should render CREATE INDEX CONCURRENTLY IF NOT EXISTS"""
+        table = Shopcart.__table__
+        index = next(i for i in table.indexes if i.name == "ix_shopcart_price_sort")
+        ddl = concurrent_index_ddl(index, db.engine.dialect)
+        self.assertTrue(
+            ddl.startswith("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_shopcart_price_sort")
+        )
+
+    def test_create_indexes(self):
+        """It should build indexes missing from an existing table"""
+        with db.engine.connect() as conn:
+            conn.execute(text("DROP INDEX IF EXISTS ix_shopcart_item_id_sort"))
+            conn.commit()
+        self.assertNotIn("ix_shopcart_item_id_sort", self._index_names())
+
+        names = create_indexes(db.engine, Shopcart.__table__)
+
+        self.assertIn("ix_shopcart_item_id_sort", names)
+        self.assertTrue(set(names) <= self._index_names())
+        # Running it again is a no-op
+        self.assertEqual(create_indexes(db.engine, Shopcart.__table__), names)
+
+    def test_drop_indexes(self):
+        """It should drop retired indexes that still exist"""
+        with db.engine.connect() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_shopcart_retired ON shopcart (quantity)"))
+            conn.commit()
+        self.assertIn("ix_shopcart_retired", self._index_names())
+
+        names = drop_indexes(db.engine, ["ix_shopcart_retired", "ix_shopcart_missing"])
+
+        self.assertEqual(names, ["ix_shopcart_retired"])
+        self.assertNotIn("ix_shopcart_retired", self._index_names())
+        self.assertEqual(drop_indexes(db.engine, ["ix_shopcart_retired"]), [])
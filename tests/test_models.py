@@ -22,11 +22,14 @@ Test cases for Shopcart Model
 import os
 import logging
 from datetime import datetime, timezone
+from decimal import Decimal
 from unittest import TestCase
 from unittest.mock import patch
+from sqlalchemy import event
 from wsgi import app
+from service.common.cart_cache import cache as cart_cache
 from service.models import Shopcart, DataValidationError, db
-from tests.factories import ShopcartFactory
+from tests.factories import ShopcartFactory, used_shopcart_pairs
 
 
 DATABASE_URI = os.getenv(
@@ -58,6 +61,8 @@ class ShopCartModelTestCase(TestCase):
         """This runs before each test"""
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.commit()
+        used_shopcart_pairs.clear()  # the rows they guarded are gone
+        cart_cache.clear()  # the rows were deleted behind its back
 
     def tearDown(self):
         """This runs after each test"""
@@ -380,6 +385,230 @@ class TestShopCartOperations(ShopCartModelTestCase):
         self.assertRaises(DataValidationError, shopcart.delete)
         patcher.stop()
 
+    def test_update_quantities(self):
+        """It should update and remove several items in one call"""
+        first = ShopcartFactory(user_id=501, quantity=1)
+        second = ShopcartFactory(user_id=501, quantity=1)
+        first.create()
+        second.create()
+
+        Shopcart.update_quantities(501, {first.item_id: 7, second.item_id: 0})
+
+        items = Shopcart.find_by_user_id(501)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].item_id, first.item_id)
+        self.assertEqual(items[0].quantity, 7)
+
+    def test_update_quantities_negative(self):
+        """It should not update any item when a quantity is negative"""
+        shopcart = ShopcartFactory(user_id=501, quantity=3)
+        shopcart.create()
+        self.assertRaises(
+            ValueError, Shopcart.update_quantities, 501, {shopcart.item_id: -1}
+        )
+        self.assertEqual(Shopcart.find(501, shopcart.item_id).quantity, 3)
+
+    def test_update_quantities_missing_item(self):
+        """It should roll back the whole batch when an item is missing"""
+        shopcart = ShopcartFactory(user_id=501, quantity=3)
+        shopcart.create()
+        self.assertRaises(
+            DataValidationError,
+            Shopcart.update_quantities,
+            501,
+            {shopcart.item_id: 5, 9999: 1},
+        )
+        self.assertEqual(Shopcart.find(501, shopcart.item_id).quantity, 3)
+
+    def test_find_item_ids(self):
+        """It should return only the item ids present in the cart"""
+        shopcart = ShopcartFactory(user_id=501)
+        shopcart.create()
+        found = Shopcart.find_item_ids(501, [shopcart.item_id, 9999])
+        self.assertEqual(found, {shopcart.item_id})
+
+    def test_upsert_creates_and_increments(self):
+        """It should insert a new entry and then add to its quantity"""
+        shopcart = ShopcartFactory(user_id=504, quantity=2)
+        cart = shopcart.upsert()
+        self.assertEqual([item.quantity for item in cart], [2])
+
+        again = Shopcart(
+            user_id=504,
+            item_id=shopcart.item_id,
+            description="Other description",
+            quantity=3,
+            price=1.0,
+        )
+        cart = again.upsert()
+        self.assertEqual(len(cart), 1)
+        self.assertEqual(cart[0].quantity, 5)
+        # The original description and price are kept
+        self.assertEqual(cart[0].description, shopcart.description)
+        self.assertEqual(len(Shopcart.find_by_user_id(504)), 1)
+
+    def test_upsert_returns_cart(self):
+        """It should return the whole cart, ordered by item_id, in one statement"""
+        for _ in range(3):
+            ShopcartFactory(user_id=505).create()
+        shopcart = ShopcartFactory(user_id=505)
+        statements = self._record_statements()
+        cart = shopcart.upsert()
+        for item in cart:
+            item.serialize()
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(
+            [item.item_id for item in cart],
+            sorted(item.item_id for item in Shopcart.find_by_user_id(505)),
+        )
+        self.assertIsNotNone(cart[0].created_at)
+
+    def _record_statements(self):
+        """Returns a list that collects the SQL sent for the rest of the test"""
+        statements = []
+
+        def record(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        self.addCleanup(event.remove, db.engine, "before_cursor_execute", record)
+        return statements
+
+    def test_write_keeps_server_defaults(self):
+        """It should serialize a written entry without reloading it"""
+        shopcart = ShopcartFactory(user_id=506, created_at=None, last_updated=None)
+        statements = self._record_statements()
+        shopcart.create()
+        self.assertIsNotNone(shopcart.serialize()["created_at"])
+        shopcart.quantity += 1
+        shopcart.update()
+        self.assertIsNotNone(shopcart.serialize()["last_updated"])
+        self.assertEqual(len(statements), 2)
+        self.assertIn("RETURNING", statements[0])
+        self.assertIn("RETURNING", statements[1])
+
+    def test_upsert_respects_max_quantity(self):
+        """It should not increment past max_quantity"""
+        shopcart = ShopcartFactory(user_id=504, quantity=4)
+        shopcart.upsert(max_quantity=5)
+        extra = Shopcart(
+            user_id=504,
+            item_id=shopcart.item_id,
+            description="extra",
+            quantity=2,
+            price=1.0,
+        )
+        self.assertIsNone(extra.upsert(max_quantity=5))
+        self.assertEqual(Shopcart.find(504, shopcart.item_id).quantity, 4)
+
+    def test_upsert_database_failure(self):
+        """It should raise a DataValidationError when the upsert fails"""
+        shopcart = ShopcartFactory(user_id=504)
+        with patch(
+            "service.models.db.session.commit", side_effect=Exception("DB error")
+        ):
+            self.assertRaises(DataValidationError, shopcart.upsert)
+
+    def test_delete_by_user_id(self):
+        """It should delete a whole cart and return the row count"""
+        for _ in range(3):
+            ShopcartFactory(user_id=505).create()
+        other = ShopcartFactory(user_id=506)
+        other.create()
+
+        self.assertEqual(Shopcart.delete_by_user_id(505), 3)
+        self.assertEqual(Shopcart.find_by_user_id(505), [])
+        self.assertEqual(len(Shopcart.find_by_user_id(506)), 1)
+        self.assertEqual(Shopcart.delete_by_user_id(505), 0)
+
+    def test_delete_by_user_id_database_failure(self):
+        """It should raise a DataValidationError when the cart delete fails"""
+        with patch(
+            "service.models.db.session.commit", side_effect=Exception("DB error")
+        ):
+            self.assertRaises(DataValidationError, Shopcart.delete_by_user_id, 505)
+
+    def test_finalize_cart(self):
+        """It should remove the cart and return its exact total"""
+        Shopcart(
+            user_id=507, item_id=1, description="a", quantity=3, price=0.1
+        ).create()
+        Shopcart(
+            user_id=507, item_id=2, description="b", quantity=1, price=0.2
+        ).create()
+
+        total = Shopcart.finalize_cart(507)
+        self.assertEqual(total, Decimal("0.50"))
+        self.assertEqual(Shopcart.find_by_user_id(507), [])
+
+    def test_finalize_missing_cart(self):
+        """It should raise a DataValidationError when there is no cart"""
+        self.assertRaises(DataValidationError, Shopcart.finalize_cart, 508)
+
+    def test_finalize_cart_database_failure(self):
+        """It should keep the cart when the checkout commit fails"""
+        ShopcartFactory(user_id=507).create()
+        with patch(
+            "service.models.db.session.commit", side_effect=Exception("DB error")
+        ):
+            self.assertRaises(DataValidationError, Shopcart.finalize_cart, 507)
+        self.assertEqual(len(Shopcart.find_by_user_id(507)), 1)
+
+    def test_batch_commits_once(self):
+        """It should stage several changes and commit them together"""
+        existing = ShopcartFactory(user_id=509)
+        existing.create()
+        with patch.object(
+            db.session, "commit", wraps=db.session.commit
+        ) as commit_mock:
+            with Shopcart.batch():
+                ShopcartFactory(user_id=509).create()
+                ShopcartFactory(user_id=509).create()
+                existing.quantity += 1
+                existing.update()
+                self.assertEqual(commit_mock.call_count, 0)
+            self.assertEqual(commit_mock.call_count, 1)
+        self.assertEqual(len(Shopcart.find_by_user_id(509)), 3)
+
+    def test_batch_nested(self):
+        """It should commit nested batches only once, at the outermost block"""
+        with Shopcart.batch():
+            ShopcartFactory(user_id=509).create()
+            with Shopcart.batch():
+                ShopcartFactory(user_id=509).create()
+        self.assertEqual(len(Shopcart.find_by_user_id(509)), 2)
+
+    def test_batch_rolls_back_on_error(self):
+        """It should discard every staged change when the block raises"""
+        with self.assertRaises(ValueError):
+            with Shopcart.batch():
+                ShopcartFactory(user_id=509).create()
+                ShopcartFactory(user_id=509, quantity=0).create()
+        self.assertEqual(Shopcart.find_by_user_id(509), [])
+
+    def test_batch_commit_failure(self):
+        """It should raise a DataValidationError when the batch commit fails"""
+        with patch(
+            "service.models.db.session.commit", side_effect=Exception("DB error")
+        ):
+            with self.assertRaises(DataValidationError):
+                with Shopcart.batch():
+                    ShopcartFactory(user_id=509).create()
+        self.assertEqual(Shopcart.find_by_user_id(509), [])
+
+    def test_batch_keeps_changes_after_caught_error(self):
+        """It should leave staged changes to the batch when a writer fails"""
+        existing = ShopcartFactory(user_id=509)
+        existing.create()
+        with Shopcart.batch():
+            ShopcartFactory(user_id=509).create()
+            with patch.object(
+                db.session, "delete", side_effect=Exception("DB error")
+            ):
+                self.assertRaises(DataValidationError, existing.delete)
+            ShopcartFactory(user_id=509).create()
+        self.assertEqual(len(Shopcart.find_by_user_id(509)), 3)
+
     def test_list_all_shopcarts(self):
         """It should List all Shopcarts in the database"""
         shopcarts = Shopcart.all()
@@ -647,9 +876,87 @@ class TestShopCartQueries(ShopCartModelTestCase):
         self.assertEqual(len(conditions), 1)
         condition_str = str(conditions[0])
 
-        # Check that the SQLAlchemy query contains the correct structure
-        self.assertIn("shopcart.user_id IN", condition_str)
-        self.assertIn("POSTCOMPILE", condition_str)
+        # The list is bound as one array, so the SQL does not depend on its length
+        self.assertIn("shopcart.user_id = ANY", condition_str)
+        self.assertNotIn("POSTCOMPILE", condition_str)
+        self.assertEqual(conditions[0].right.element.value, [1, 2, 3])
+
+    def test_find_cart_page(self):
+        """It should return carts in key order with the key of the next page"""
+        for _ in range(3):
+            ShopcartFactory(user_id=510).create()
+        ShopcartFactory(user_id=511).create()
+        item_ids = sorted(item.item_id for item in Shopcart.find_by_user_id(510))
+
+        carts, next_key = Shopcart.find_cart_page(limit=2)
+        self.assertEqual(len(carts), 1)
+        self.assertEqual(carts[0]["user_id"], 510)
+        self.assertEqual([item["item_id"] for item in carts[0]["items"]], item_ids[:2])
+        self.assertEqual(next_key, (510, item_ids[1]))
+
+        carts, next_key = Shopcart.find_cart_page(limit=2, after=next_key)
+        self.assertEqual([cart["user_id"] for cart in carts], [510, 511])
+        self.assertEqual([item["item_id"] for item in carts[0]["items"]], item_ids[2:])
+        self.assertIsNone(next_key)
+
+    def test_find_cart_page_items(self):
+        """It should build the same items as serialize()"""
+        for microsecond in (0, 123450, 5):
+            Shopcart.query.delete()
+            shopcart = ShopcartFactory(
+                user_id=512, created_at=datetime(2024, 5, 1, 10, 0, 0, microsecond)
+            )
+            shopcart.create()
+            carts, _ = Shopcart.find_cart_page()
+            item = carts[0]["items"][0]
+            self.assertEqual(item, Shopcart.find(512, shopcart.item_id).serialize())
+
+    def test_find_cart_page_next_user(self):
+        """It should end a page before the first item of the next cart"""
+        ShopcartFactory(user_id=513).create()
+        shopcart = ShopcartFactory(user_id=514)
+        shopcart.create()
+        carts, next_key = Shopcart.find_cart_page(limit=1)
+        self.assertEqual([cart["user_id"] for cart in carts], [513])
+        self.assertEqual(next_key, (513, carts[0]["items"][0]["item_id"]))
+
+    def test_find_rows(self):
+        """It should read plain rows that serialize like the instances"""
+        for _ in range(3):
+            ShopcartFactory(user_id=515).create()
+        ShopcartFactory(user_id=516).create()
+        expected = sorted(
+            (item.serialize() for item in Shopcart.all()),
+            key=lambda item: (item["user_id"], item["item_id"]),
+        )
+        db.session.expunge_all()
+
+        rows = Shopcart.all_rows()
+        self.assertEqual([Shopcart.serialize_row(row) for row in rows], expected)
+        self.assertEqual(len(db.session.identity_map), 0)
+
+        rows = Shopcart.find_rows_by_user_id(515)
+        self.assertEqual([Shopcart.serialize_row(row) for row in rows], expected[:3])
+        self.assertEqual(Shopcart.find_rows_by_user_id(517), [])
+
+        filters = {"user_id": {"operator": "gt", "value": "515"}}
+        rows = Shopcart.find_rows_with_filter(filters)
+        self.assertEqual([Shopcart.serialize_row(row) for row in rows], expected[3:])
+        self.assertEqual(len(Shopcart.find_rows_with_filter()), 4)
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_find_rows_reuses_statement(self):
+        """It should build the statement of a row reader only once"""
+        Shopcart.find_rows_by_user_id(518)
+        Shopcart.all_rows()
+        with patch("service.models.select", side_effect=AssertionError("rebuilt")):
+            self.assertEqual(Shopcart.find_rows_by_user_id(519), [])
+            self.assertEqual(Shopcart.all_rows(), [])
+
+    def test_build_filter_conditions_description_exact(self):
+        """It should only allow exact matches on description"""
+        filters = {"description": {"operator": "gt", "value": "a"}}
+        self.assertRaises(ValueError, Shopcart._build_filter_conditions, filters)
 
     def test_find_by_ranges_direct(self):
         """It should directly test find_by_ranges to ensure coverage"""
@@ -0,0 +1,158 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for MessagePack requests and responses
+"""
+
+# pylint: disable=duplicate-code
+from datetime import datetime, timezone
+from unittest import skipUnless
+from flask import request
+from wsgi import app
+from service.common import msgpack_codec, status
+from service.common.msgpack_codec import MSGPACK_MIMETYPE, dumps, loads
+from .test_routes import TestShopcartService
+
+MSGPACK = {"Accept": MSGPACK_MIMETYPE}
+
+
+@skipUnless(msgpack_codec.available(), "msgpack is not installed")
+class TestMsgpack(TestShopcartService):
+    """Test cases for application/msgpack content negotiation"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, FAST_JSON=False)
+
+    def test_codec(self):
+        """It should send timestamps as native UTC timestamps"""
+        data = {"items": [{"price": 1.5, "created_at": "2024-05-01T10:00:00.123456"}]}
+        decoded = loads(dumps(data))
+        self.assertEqual(
+            decoded["items"][0]["created_at"],
+            datetime(2024, 5, 1, 10, 0, 0, 123456, tzinfo=timezone.utc),
+        )
+        self.assertEqual(decoded["items"][0]["price"], 1.5)
+        for text in ("2024-05-01T10:00:00+00:00", "2024-05-01T10:00:00Z"):
+            self.assertEqual(
+                loads(dumps({"last_updated": text}))["last_updated"],
+                datetime(2024, 5, 1, 10, tzinfo=timezone.utc),
+            )
+
+    def test_get_every_resource(self):
+        """It should return the JSON payloads as MessagePack"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1)
+        item_id = shopcarts[0].item_id
+        for fast_json in (False, True):
+            app.config["FAST_JSON"] = fast_json
+            for url in (
+                "/api/shopcarts",
+                "/api/shopcarts/1",
+                "/api/shopcarts/1/items",
+                f"/api/shopcarts/1/items/{item_id}",
+            ):
+                expected = self.client.get(url).get_json()
+                resp = self.client.get(url, headers=MSGPACK)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK, url)
+                self.assertEqual(resp.mimetype, MSGPACK_MIMETYPE)
+                data = loads(resp.data)
+                if isinstance(data, dict):
+                    items = [data]
+                else:
+                    items = [item for cart in data for item in cart["items"]]
+                for item in items:
+                    if "created_at" in item:
+                        self.assertIsInstance(item["created_at"], datetime)
+                        self.assertIsInstance(item["last_updated"], datetime)
+                        self.assertIsInstance(item["price"], float)
+                self.assertEqual(self._as_json(data), self._as_json(expected), url)
+
+    @staticmethod
+    def _as_json(data):
+        """Drops the timestamps, which JSON and MessagePack spell differently"""
+        if isinstance(data, list):
+            return [TestMsgpack._as_json(item) for item in data]
+        if isinstance(data, dict):
+            return {
+                key: TestMsgpack._as_json(value)
+                for key, value in data.items()
+                if key not in msgpack_codec.TIMESTAMP_FIELDS
+            }
+        return data
+
+    def test_columnar(self):
+        """It should send the timestamp columns of a columnar page as timestamps"""
+        self._populate_shopcarts(count=2, user_id=1)
+        resp = self.client.get(
+            "/api/shopcarts?format=columnar&fields=item_id,created_at", headers=MSGPACK
+        )
+        self.assertEqual(resp.mimetype, MSGPACK_MIMETYPE)
+        page = loads(resp.data)
+        self.assertEqual(page["columns"], ["item_id", "created_at"])
+        self.assertEqual(len(page["data"][0]), 2)
+        for created_at in page["data"][1]:
+            self.assertIsInstance(created_at, datetime)
+
+    def test_post_and_put(self):
+        """It should read MessagePack request bodies"""
+        body = dumps({"item_id": 7, "description": "Pen", "price": 2.5, "quantity": 2})
+        resp = self.client.post(
+            "/api/shopcarts/1", data=body, content_type=MSGPACK_MIMETYPE, headers=MSGPACK
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.mimetype, MSGPACK_MIMETYPE)
+        self.assertEqual(loads(resp.data)[0]["quantity"], 2)
+
+        body = dumps({"items": [{"item_id": 7, "quantity": 5}]})
+        resp = self.client.put(
+            "/api/shopcarts/1", data=body, content_type=MSGPACK_MIMETYPE
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()[0]["quantity"], 5)
+
+    def test_bad_body(self):
+        """It should reject a body that is not MessagePack with 400"""
+        resp = self.client.post(
+            "/api/shopcarts/1/items",
+            data=b"\xc1",
+            content_type=MSGPACK_MIMETYPE,
+            headers=MSGPACK,
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.mimetype, MSGPACK_MIMETYPE)
+        with app.test_request_context(data=b"\xc1", content_type=MSGPACK_MIMETYPE):
+            self.assertIsNone(request.get_json(silent=True))
+
+    def test_errors_and_streams(self):
+        """It should encode errors and keep NDJSON streams available"""
+        resp = self.client.get("/api/shopcarts/9", headers=MSGPACK)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("message", loads(resp.data))
+
+        self._populate_shopcarts(count=1, user_id=1)
+        resp = self.client.get(
+            "/api/shopcarts",
+            headers={"Accept": f"{MSGPACK_MIMETYPE};q=0.5, application/x-ndjson"},
+        )
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+
+    def test_swagger(self):
+        """It should document MessagePack as a response type"""
+        resp = self.client.get("/api/swagger.json")
+        self.assertIn(MSGPACK_MIMETYPE, resp.get_json()["produces"])
+        operation = resp.get_json()["paths"]["/shopcarts"]["get"]
+        self.assertIn(MSGPACK_MIMETYPE, operation["produces"])
@@ -108,20 +108,20 @@ class TestShopcartPost(TestShopcartService):
 
     def test_add_item_internal_server_error_update(self):
         """It should return a 500 error when the database update fails"""
+        user_id = 1
+        # First, add the item
+        payload = {
+            "item_id": 101,
+            "description": "Test Item",
+            "price": 9.99,
+            "quantity": 2,
+        }
+        response = self.client.post(f"/api/shopcarts/{user_id}", json=payload)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
         with patch(
-            "service.models.Shopcart.update", side_effect=Exception("Database error")
+            "service.models.db.session.commit", side_effect=Exception("Database error")
         ):
-            user_id = 1
-            # First, add the item
-            payload = {
-                "item_id": 101,
-                "description": "Test Item",
-                "price": 9.99,
-                "quantity": 2,
-            }
-            response = self.client.post(f"/api/shopcarts/{user_id}", json=payload)
-            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-
             # Add the same item again
             payload2 = {
                 "item_id": 101,
@@ -137,7 +137,7 @@ class TestShopcartPost(TestShopcartService):
     def test_add_item_internal_server_error_create(self):
         """It should return a 500 error when the database creation fails"""
         with patch(
-            "service.models.Shopcart.create", side_effect=Exception("Database error")
+            "service.models.Shopcart.upsert", side_effect=Exception("Database error")
         ):
             user_id = 1
             # First, add the item
@@ -276,6 +276,7 @@ class TestAddProductToCart(TestShopcartService):
         )
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Only 5 units are available", response.get_json()["message"])
 
     def test_add_product_exceeds_purchase_limit_when_combined(self):
         """It should return a 400 error if adding more would exceed purchase limit"""
@@ -305,7 +306,7 @@ class TestAddProductToCart(TestShopcartService):
 
         # Now try to add more of the same item, but mock an exception during update
         with patch(
-            "service.models.Shopcart.update", side_effect=Exception("Update error")
+            "service.models.db.session.commit", side_effect=Exception("Update error")
         ):
             additional_payload = mock_product(product_id=111, stock=10, quantity=1)
             response = self.client.post(
@@ -319,7 +320,7 @@ class TestAddProductToCart(TestShopcartService):
         user_id = 1
         # Try to add a new item, but mock an exception during creation
         with patch(
-            "service.models.Shopcart.create", side_effect=Exception("Create error")
+            "service.models.Shopcart.upsert", side_effect=Exception("Create error")
         ):
             payload = mock_product(product_id=111, stock=10, quantity=1)
             response = self.client.post(f"/api/shopcarts/{user_id}/items", json=payload)
@@ -129,9 +129,10 @@ class TestShopcartPut(TestShopcartService):
         # Update with quantity 0 to trigger deletion
         update_cart = {"items": [{"item_id": shopcarts[0].item_id, "quantity": 0}]}
 
-        # Mock the delete method to raise an exception
+        # Mock the bulk update to raise an exception
         with patch(
-            "service.models.Shopcart.delete", side_effect=Exception("Delete error")
+            "service.models.Shopcart.update_quantities",
+            side_effect=Exception("Delete error"),
         ):
             response = self.client.put(f"/api/shopcarts/{user_id}", json=update_cart)
             self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -145,9 +146,9 @@ class TestShopcartPut(TestShopcartService):
         # Update with a new quantity
         update_cart = {"items": [{"item_id": shopcarts[0].item_id, "quantity": 10}]}
 
-        # Mock the update method to raise an exception
+        # Mock the commit to raise an exception
         with patch(
-            "service.models.Shopcart.update", side_effect=Exception("Update error")
+            "service.models.db.session.commit", side_effect=Exception("Update error")
         ):
             response = self.client.put(f"/api/shopcarts/{user_id}", json=update_cart)
             self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -173,6 +174,43 @@ class TestShopcartPut(TestShopcartService):
         # Check response status and error message
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+        # Nothing should have been applied
+        response = self.client.get(f"/api/shopcarts/{user_id}/items/{existing_item_id}")
+        self.assertEqual(response.get_json()["quantity"], shopcarts[0].quantity)
+
+    def test_update_shopcart_is_all_or_nothing(self):
+        """It should not apply any change when one of the items is invalid"""
+        user_id = 502
+        shopcarts = self._populate_shopcarts(count=2, user_id=user_id)
+        update_cart = {
+            "items": [
+                {"item_id": shopcarts[0].item_id, "quantity": 0},
+                {"item_id": shopcarts[1].item_id, "quantity": -1},
+            ]
+        }
+        response = self.client.put(f"/api/shopcarts/{user_id}", json=update_cart)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f"/api/shopcarts/{user_id}/items")
+        self.assertEqual(len(response.get_json()[0]["items"]), 2)
+
+    def test_update_shopcart_duplicate_item(self):
+        """It should return a 400 error when an item is listed more than once"""
+        user_id = 503
+        shopcarts = self._populate_shopcarts(count=1, user_id=user_id)
+        item_id = shopcarts[0].item_id
+        update_cart = {
+            "items": [
+                {"item_id": item_id, "quantity": 2},
+                {"item_id": item_id, "quantity": 5},
+            ]
+        }
+        response = self.client.put(f"/api/shopcarts/{user_id}", json=update_cart)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f"/api/shopcarts/{user_id}/items/{item_id}")
+        self.assertEqual(response.get_json()["quantity"], shopcarts[0].quantity)
+
     def test_update_cart_item_success(self):
         """It should update a specific item in a user's shopcart"""
         user_id = 1
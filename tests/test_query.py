@@ -359,6 +359,24 @@ class TestQuery(TestShopcartService):
         resp = self.client.get("/api/shopcarts?user_id_range=10,2")
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_filter_by_description_is_exact(self):
+        """It should match descriptions exactly, even when they contain commas"""
+        self.client.post(
+            "/api/shopcarts/1",
+            json={"item_id": 1, "description": "Red, large", "price": 1.0},
+        )
+        self.client.post(
+            "/api/shopcarts/1",
+            json={"item_id": 2, "description": "Red", "price": 1.0},
+        )
+        resp = self.client.get("/api/shopcarts?description=Red, large")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        items = resp.get_json()[0]["items"]
+        self.assertEqual([item["item_id"] for item in items], [1])
+
+        resp = self.client.get("/api/shopcarts?description_range=a,b")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_apply_range_filters_no_filters(self):
         """It should return all shopcart items when no range filters are provided."""
         # Populate shopcart for user 1
@@ -480,3 +498,52 @@ class TestQuery(TestShopcartService):
         for item in all_items:
             self.assertGreaterEqual(item["price"], 70.0)
             self.assertLessEqual(item["price"], 80.0)
+
+    ######################################################################
+    #  P A G I N A T I O N
+
+    def _list_all_pages(self, query):
+        """Follows X-Next-Cursor through every page of /api/shopcarts"""
+        keys, pages, cursor = [], 0, None
+        while True:
+            url = f"/api/shopcarts?{query}"
+            if cursor:
+                url += f"&next={cursor}"
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages += 1
+            for cart in resp.get_json():
+                keys.extend((cart["user_id"], item["item_id"]) for item in cart["items"])
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                return keys, pages
+
+    def test_list_shopcarts_paginated(self):
+        """It should page through every item in (user_id, item_id) order"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1)
+        shopcarts += self._populate_shopcarts(count=2, user_id=2)
+        expected = sorted((s.user_id, s.item_id) for s in shopcarts)
+
+        keys, pages = self._list_all_pages("limit=2")
+        self.assertEqual(keys, expected)
+        self.assertEqual(pages, 3)
+
+        resp = self.client.get("/api/shopcarts?limit=5")
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_list_shopcarts_paginated_with_filters(self):
+        """It should combine pagination with filters"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1, quantity=5)
+        self._populate_shopcarts(count=2, user_id=1, quantity=10)
+        shopcarts += self._populate_shopcarts(count=2, user_id=2, quantity=5)
+        expected = sorted((s.user_id, s.item_id) for s in shopcarts)
+
+        keys, pages = self._list_all_pages("quantity=5&limit=2")
+        self.assertEqual(keys, expected)
+        self.assertEqual(pages, 3)
+
+    def test_list_shopcarts_invalid_paging(self):
+        """It should reject invalid limits and cursors"""
+        for query in ("limit=0", "limit=abc", "limit=100000", "next=not-a-cursor"):
+            resp = self.client.get(f"/api/shopcarts?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
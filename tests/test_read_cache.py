@@ -0,0 +1,91 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the request-scoped read cache
+"""
+from unittest.mock import patch
+from wsgi import app
+from service.common import read_cache, status
+from service.models import Shopcart, DataValidationError
+from tests.factories import ShopcartFactory
+from .test_routes import TestShopcartService
+
+
+class TestReadCache(TestShopcartService):
+    """Test Cases for memoized reads"""
+
+    def test_repeated_read_is_cached(self):
+        """It should run a repeated read only once per request"""
+        ShopcartFactory(user_id=1).create()
+        with app.test_request_context():
+            first = Shopcart.find_by_user_id(1)
+            self.assertIs(Shopcart.find_by_user_id(1), first)
+            Shopcart.find_by_user_id(2)
+            self.assertEqual(read_cache.stats(), {"hits": 1, "misses": 2})
+
+    def test_filters_are_part_of_the_key(self):
+        """It should cache reads with dictionary arguments by their contents"""
+        filters = {"quantity": {"operator": "in", "value": ["1", "2"]}}
+        with app.test_request_context():
+            Shopcart.find_all_with_filter(filters=filters)
+            Shopcart.find_all_with_filter(
+                filters={"quantity": {"value": ["1", "2"], "operator": "in"}}
+            )
+            Shopcart.find_all_with_filter(filters={})
+            self.assertEqual(read_cache.stats(), {"hits": 1, "misses": 2})
+
+    def test_writes_invalidate(self):
+        """It should read again after the data changes"""
+        with app.test_request_context():
+            self.assertEqual(Shopcart.find_by_user_id(1), [])
+            ShopcartFactory(user_id=1).create()
+            self.assertEqual(len(Shopcart.find_by_user_id(1)), 1)
+
+    def test_failed_writes_invalidate(self):
+        """It should read again after a failed write is rolled back"""
+        shopcart = ShopcartFactory(user_id=1)
+        with app.test_request_context():
+            with patch(
+                "service.models.db.session.commit", side_effect=Exception("DB error")
+            ):
+                self.assertRaises(DataValidationError, shopcart.create)
+            self.assertEqual(Shopcart.find_by_user_id(1), [])
+            with self.assertRaises(ValueError):
+                with Shopcart.batch():
+                    ShopcartFactory(user_id=1).create()
+                    Shopcart.find_by_user_id(1)
+                    raise ValueError("abandon the batch")
+            self.assertEqual(Shopcart.find_by_user_id(1), [])
+
+    def test_no_cache_outside_requests(self):
+        """It should not cache reads made outside of a request"""
+        Shopcart.find_by_user_id(1)
+        read_cache.invalidate()
+        self.assertEqual(read_cache.stats(), {"hits": 0, "misses": 0})
+
+    def test_debug_header(self):
+        """It should report the counters when READ_CACHE_DEBUG is set"""
+        self._populate_shopcarts(count=1, user_id=1)
+        app.config["READ_CACHE_DEBUG"] = True
+        self.addCleanup(app.config.update, READ_CACHE_DEBUG=False)
+        resp = self.client.get("/api/shopcarts/1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers[read_cache.DEBUG_HEADER], "hits=0, misses=1")
+
+        app.config["READ_CACHE_DEBUG"] = False
+        resp = self.client.get("/api/shopcarts/1")
+        self.assertNotIn(read_cache.DEBUG_HEADER, resp.headers)
@@ -0,0 +1,159 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for searching the item descriptions with ?q=
+"""
+
+# pylint: disable=duplicate-code
+from unittest import TestCase
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from wsgi import app
+from service.common import status
+from service.common.helpers import extract_item_filters
+from service.common.migrations import create_trigram_index
+from service.models import Shopcart, TRIGRAM_INDEX, db
+from .test_routes import TestShopcartService
+
+SEARCH_URL = "/api/shopcarts/search"
+
+
+class TestSearchFilter(TestCase):
+    """Test cases for parsing and compiling the q filter"""
+
+    def test_extract_q(self):
+        """It should turn q into a contains filter on the description"""
+        self.assertEqual(
+            extract_item_filters({"q": " pen "}),
+            {"description": {"operator": "contains", "value": "pen"}},
+        )
+        self.assertRaises(ValueError, extract_item_filters, {"q": "pe "})
+        self.assertRaises(ValueError, extract_item_filters, {"q": "pen", "description": "Pen"})
+
+    def test_compile_contains(self):
+        """It should match the text literally and only on descriptions"""
+        _, params = Shopcart._compile_filters(
+            {"description": {"operator": "contains", "value": "50%_off\\"}}
+        )
+        self.assertEqual(params["filter_description"], "%50\\%\\_off\\\\%")
+        self.assertRaises(
+            ValueError,
+            Shopcart._compile_filters,
+            {"quantity": {"operator": "contains", "value": "5"}},
+        )
+        self.assertRaises(
+            ValueError,
+            Shopcart._compile_filters,
+            {"description": {"operator": "gt", "value": "pen"}},
+        )
+
+    def test_trigram_statement(self):
+        """It should rank by similarity when pg_trgm is installed"""
+        conditions = Shopcart._filter_conditions((("description", "contains"),))
+        sql = str(
+            Shopcart._search_statement(conditions, None, True).compile(
+                dialect=postgresql.dialect()
+            )
+        )
+        self.assertIn("shopcart.description ILIKE", sql)
+        self.assertIn("ORDER BY similarity(shopcart.description", sql)
+        sql = str(
+            Shopcart._search_statement(conditions, None, False).compile(
+                dialect=postgresql.dialect()
+            )
+        )
+        self.assertIn("ORDER BY length(shopcart.description)", sql)
+
+
+class TestShopcartSearch(TestShopcartService):
+    """Test cases for GET /shopcarts/search and the q filter"""
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(app.config.update, SEARCH_MAX_RESULTS=app.config["SEARCH_MAX_RESULTS"])
+
+    def _add_items(self, *descriptions, user_id=1):
+        """Adds one item per description to a user's cart"""
+        for item_id, description in enumerate(descriptions, start=1):
+            resp = self.client.post(
+                f"/api/shopcarts/{user_id}",
+                json={"item_id": item_id, "description": description, "price": 2.5, "quantity": 1},
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_search(self):
+        """It should find the text anywhere in the description, best match first"""
+        self._add_items("Blue ballpoint pen with a rubber grip", "Red Pen", "Pencil case", "Notebook")
+        resp = self.client.get(SEARCH_URL, query_string={"q": "pen"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        descriptions = [item["description"] for item in resp.get_json()]
+        self.assertEqual(len(descriptions), 3)
+        self.assertEqual(descriptions[-1], "Blue ballpoint pen with a rubber grip")
+        self.assertNotIn("Notebook", descriptions)
+
+    def test_search_literal(self):
+        """It should not treat % and _ in the text as wildcards"""
+        self._add_items("50% off mug", "500 mugs", "snake_case sticker", "snakeXcase sticker")
+        for query, expected in (("50% off", ["50% off mug"]), ("e_c", ["snake_case sticker"])):
+            items = self.client.get(SEARCH_URL, query_string={"q": query}).get_json()
+            self.assertEqual([item["description"] for item in items], expected)
+
+    def test_search_filters_and_limit(self):
+        """It should apply the other filters and cap the results"""
+        self._add_items("Red pen", "Blue pen", "Green pen", user_id=1)
+        self._add_items("Black pen", user_id=2)
+        items = self.client.get(SEARCH_URL, query_string={"q": "PEN", "user_id": "2"}).get_json()
+        self.assertEqual([item["description"] for item in items], ["Black pen"])
+
+        items = self.client.get(SEARCH_URL, query_string={"q": "pen", "limit": "2"}).get_json()
+        self.assertEqual(len(items), 2)
+        app.config["SEARCH_MAX_RESULTS"] = 3
+        items = self.client.get(SEARCH_URL, query_string={"q": "pen"}).get_json()
+        self.assertEqual(len(items), 3)
+        resp = self.client.get(SEARCH_URL, query_string={"q": "pen", "limit": "4"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        items = self.client.get(
+            SEARCH_URL, query_string={"q": "pen", "fields": "item_id"}
+        ).get_json()
+        self.assertEqual(items[0], {"item_id": 1})
+
+    def test_bad_search(self):
+        """It should reject a missing, short or conflicting q with 400"""
+        for query in ({}, {"q": "pe"}, {"q": "pen", "description": "Red pen"}, {"description": "Red pen"}):
+            resp = self.client.get(SEARCH_URL, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_q_filter(self):
+        """It should filter the listing, the carts and the stats with q"""
+        self._add_items("Red pen", "Notebook", user_id=1)
+        self._add_items("Stapler", user_id=2)
+        carts = self.client.get("/api/shopcarts", query_string={"q": "red"}).get_json()
+        self.assertEqual(len(carts), 1)
+        self.assertEqual([item["description"] for item in carts[0]["items"]], ["Red pen"])
+        carts = self.client.get("/api/shopcarts/1", query_string={"q": "book"}).get_json()
+        self.assertEqual([item["description"] for item in carts[0]["items"]], ["Notebook"])
+        stats = self.client.get("/api/shopcarts/stats", query_string={"q": "ple"}).get_json()
+        self.assertEqual(stats["items"], 1)
+
+    def test_trigram_index(self):
+        """It should build the trigram index only where pg_trgm can be installed"""
+        built = create_trigram_index(db.engine, "shopcart", "description", TRIGRAM_INDEX)
+        names = {index["name"] for index in inspect(db.engine).get_indexes("shopcart")}
+        self.assertEqual(TRIGRAM_INDEX in names, built)
+        Shopcart._trigram = None
+        self.assertEqual(Shopcart.trigram_search(), built)
@@ -0,0 +1,158 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for sorted listings with ?sort=
+"""
+
+# pylint: disable=duplicate-code
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+from service.common import status
+from service.common.helpers import (
+    NDJSON_MIMETYPE,
+    decode_columnar,
+    decode_cursor,
+    encode_cursor,
+    parse_sort,
+)
+from service.models import SORT_FIELDS, Shopcart
+from .test_routes import TestShopcartService
+
+
+class TestParseSort(TestCase):
+    """Test cases for parsing the sort parameter and its cursors"""
+
+    def test_parse_sort(self):
+        """It should return (field, descending) pairs of sortable fields"""
+        self.assertIsNone(parse_sort(None))
+        self.assertEqual(
+            parse_sort("price, -last_updated"), (("price", False), ("last_updated", True))
+        )
+        for value in ("secret", "description", "price,-price", "", "price,"):
+            self.assertRaises(ValueError, parse_sort, value)
+
+    def test_sort_key(self):
+        """It should end every sort with the rest of the primary key"""
+        self.assertEqual(
+            Shopcart.sort_key(None), (("user_id", False), ("item_id", False))
+        )
+        self.assertEqual(
+            Shopcart.sort_key((("price", False), ("last_updated", True))),
+            (("price", False), ("last_updated", True), ("user_id", True), ("item_id", True)),
+        )
+        self.assertEqual(
+            Shopcart.sort_key((("item_id", True),)), (("item_id", True), ("user_id", True))
+        )
+
+    def test_cursor(self):
+        """It should round-trip the sort key of an item"""
+        sort = (("price", True), ("created_at", False))
+        key = (Decimal("12.50"), datetime(2024, 5, 1, 10, 0, 0, 5), 3, 7)
+        self.assertEqual(decode_cursor(encode_cursor(key), sort), key)
+        self.assertEqual(decode_cursor(encode_cursor((3, 7))), (3, 7))
+        # A cursor only fits the sort it was listed with
+        self.assertRaises(ValueError, decode_cursor, encode_cursor((3, 7)), sort)
+        self.assertRaises(ValueError, decode_cursor, encode_cursor(("x", 1, 3, 7)), sort)
+
+
+class TestSortedListing(TestShopcartService):
+    """Test cases for GET /api/shopcarts?sort="""
+
+    def _populate(self):
+        """Creates items with some prices in common"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1, price=10.0)
+        shopcarts += self._populate_shopcarts(count=2, user_id=2)
+        shopcarts += self._populate_shopcarts(count=2, user_id=3, price=10.0)
+        return shopcarts
+
+    @staticmethod
+    def _sorted(items, sort):
+        """Sorts item dictionaries by a full sort key, like the database"""
+        for field, descending in reversed(Shopcart.sort_key(parse_sort(sort))):
+            items = sorted(items, key=lambda item, field=field: item[field], reverse=descending)
+        return [(item["user_id"], item["item_id"]) for item in items]
+
+    def _list_all_pages(self, query):
+        """Follows X-Next-Cursor through every columnar page"""
+        keys, pages, cursor = [], 0, None
+        while True:
+            url = f"/api/shopcarts?format=columnar&{query}"
+            if cursor:
+                url += f"&next={cursor}"
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            pages += 1
+            keys.extend((item["user_id"], item["item_id"]) for item in decode_columnar(resp.get_json()))
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                return keys, pages
+
+    def test_sorted_pages(self):
+        """It should page through every item in the requested order"""
+        self._populate()
+        items = decode_columnar(self.client.get("/api/shopcarts?format=columnar").get_json())
+        for item in items:
+            for field in ("created_at", "last_updated"):
+                item[field] = datetime.fromisoformat(item[field])
+        for sort in ("-price", "price,-last_updated", "-quantity,created_at", "-user_id", "item_id"):
+            keys, pages = self._list_all_pages(f"sort={sort}&limit=2")
+            self.assertEqual(keys, self._sorted(items, sort), sort)
+            self.assertEqual(pages, 4, sort)
+
+    def test_sorted_carts(self):
+        """It should list carts in the order of their first item"""
+        self._populate()
+        carts = self.client.get("/api/shopcarts?sort=-price,item_id").get_json()
+        prices = [item["price"] for cart in carts for item in cart["items"]]
+        # Items of one user are grouped, so a cart holds only its run of items
+        self.assertEqual(sorted(prices, reverse=True)[0], prices[0])
+        for cart in carts:
+            cart_prices = [item["price"] for item in cart["items"]]
+            self.assertEqual(cart_prices, sorted(cart_prices, reverse=True))
+
+        resp = self.client.get("/api/shopcarts?sort=-price&limit=3")
+        cursor = resp.headers["X-Next-Cursor"]
+        resp = self.client.get(f"/api/shopcarts?sort=-price&limit=10&next={cursor}")
+        self.assertEqual(sum(len(cart["items"]) for cart in resp.get_json()), 4)
+
+    def test_sort_with_filters(self):
+        """It should sort only the filtered items"""
+        self._populate()
+        resp = self.client.get("/api/shopcarts?format=columnar&sort=-item_id&price=10.0")
+        item_ids = resp.get_json()["data"][1]
+        self.assertEqual(len(item_ids), 5)
+        self.assertEqual(item_ids, sorted(item_ids, reverse=True))
+
+    def test_bad_sort(self):
+        """It should reject bad sorts and cursors of another sort with 400"""
+        self._populate()
+        cursor = self.client.get("/api/shopcarts?limit=2").headers["X-Next-Cursor"]
+        for query in ("sort=description", "sort=-", f"sort=price&next={cursor}"):
+            resp = self.client.get(f"/api/shopcarts?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+        resp = self.client.get("/api/shopcarts?sort=price", headers={"Accept": NDJSON_MIMETYPE})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sort_indexes(self):
+        """It should have an index in the order of every sortable column"""
+        table = Shopcart.__table__
+        orders = {tuple(column.name for column in index.columns) for index in table.indexes}
+        orders.add(tuple(column.name for column in table.primary_key))
+        for field in SORT_FIELDS:
+            key = tuple(name for name, _ in Shopcart.sort_key(((field, False),)))
+            self.assertIn(key, orders, field)
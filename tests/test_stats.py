@@ -0,0 +1,146 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the shopcart statistics endpoint
+"""
+
+# pylint: disable=duplicate-code
+from datetime import date
+from statistics import median
+from unittest import TestCase, skipUnless
+from service.common import msgpack_codec, status
+from service.common.helpers import parse_group_by
+from .test_routes import TestShopcartService
+
+STATS_URL = "/api/shopcarts/stats"
+
+
+class TestParseGroupBy(TestCase):
+    """Test cases for parsing the group_by parameter"""
+
+    def test_parse_group_by(self):
+        """It should accept the known groups only"""
+        self.assertIsNone(parse_group_by(None))
+        self.assertEqual(parse_group_by("week"), "week")
+        self.assertRaises(ValueError, parse_group_by, "year")
+
+
+class TestShopcartStats(TestShopcartService):
+    """Test cases for GET /shopcarts/stats"""
+
+    @staticmethod
+    def _cart_values(shopcarts):
+        """Returns the value of each user's cart"""
+        values = {}
+        for item in shopcarts:
+            values[item.user_id] = values.get(item.user_id, 0) + float(item.price) * item.quantity
+        return values
+
+    def test_totals(self):
+        """It should total every cart in one response"""
+        shopcarts = self._populate_shopcarts(count=3, user_id=1)
+        shopcarts += self._populate_shopcarts(count=2, user_id=2)
+        shopcarts += self._populate_shopcarts(count=1, user_id=3)
+        resp = self.client.get(STATS_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        values = self._cart_values(shopcarts)
+        self.assertEqual(stats["carts"], 3)
+        self.assertEqual(stats["items"], 6)
+        self.assertEqual(stats["units"], sum(item.quantity for item in shopcarts))
+        self.assertAlmostEqual(stats["value"], sum(values.values()), places=2)
+        self.assertEqual(stats["avg_cart_items"], 2)
+        self.assertAlmostEqual(stats["avg_cart_value"], sum(values.values()) / 3, places=2)
+        self.assertEqual(stats["cart_items_percentiles"]["p50"], 2)
+        self.assertAlmostEqual(
+            stats["cart_value_percentiles"]["p50"], median(values.values()), places=2
+        )
+        self.assertEqual(set(stats["cart_value_percentiles"]), {"p50", "p90", "p99"})
+
+    def test_filters(self):
+        """It should only count the items matching the filters"""
+        self._populate_shopcarts(count=2, user_id=1, quantity=1)
+        self._populate_shopcarts(count=3, user_id=2, quantity=10)
+        stats = self.client.get(STATS_URL, query_string={"quantity": "~gt~5"}).get_json()
+        self.assertEqual(stats["carts"], 1)
+        self.assertEqual(stats["items"], 3)
+        self.assertEqual(stats["units"], 30)
+
+        stats = self.client.get(STATS_URL, query_string={"user_id": "9"}).get_json()
+        self.assertEqual(stats["carts"], 0)
+        self.assertEqual(stats["items"], 0)
+        self.assertEqual(stats["value"], 0)
+        self.assertIsNone(stats["avg_cart_value"])
+        self.assertIsNone(stats["cart_value_percentiles"])
+
+    def test_group_by_user(self):
+        """It should list the statistics of each user's cart"""
+        shopcarts = self._populate_shopcarts(count=2, user_id=2)
+        shopcarts += self._populate_shopcarts(count=1, user_id=1)
+        resp = self.client.get(STATS_URL, query_string={"group_by": "user_id"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        self.assertEqual([group["user_id"] for group in stats], [1, 2])
+        self.assertEqual([group["items"] for group in stats], [1, 2])
+        values = self._cart_values(shopcarts)
+        for group in stats:
+            self.assertEqual(group["carts"], 1)
+            self.assertAlmostEqual(group["value"], values[group["user_id"]], places=2)
+
+    def test_group_by_date(self):
+        """It should list the statistics of each creation day, week and month"""
+        self._populate_shopcarts(count=2, user_id=1)
+        self._populate_shopcarts(count=2, user_id=2)
+        today = date.today()
+        for group_by in ("day", "week", "month"):
+            stats = self.client.get(STATS_URL, query_string={"group_by": group_by}).get_json()
+            self.assertEqual(len(stats), 1, group_by)
+            self.assertLessEqual(date.fromisoformat(stats[0][group_by]), today)
+            self.assertEqual(stats[0]["carts"], 2)
+            self.assertEqual(stats[0]["items"], 4)
+        stats = self.client.get(STATS_URL, query_string={"group_by": "day"}).get_json()
+        self.assertEqual(stats[0]["day"], today.isoformat())
+
+        stats = self.client.get(
+            STATS_URL, query_string={"group_by": "day", "user_id": "9"}
+        ).get_json()
+        self.assertEqual(stats, [])
+
+    def test_bad_request(self):
+        """It should reject an unknown group_by or a bad filter with 400"""
+        for query in ({"group_by": "year"}, {"price": "abc"}):
+            resp = self.client.get(STATS_URL, query_string=query)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_stats_see_writes(self):
+        """It should include items added after an earlier request"""
+        self._populate_shopcarts(count=1, user_id=1)
+        self.assertEqual(self.client.get(STATS_URL).get_json()["items"], 1)
+        self._populate_shopcarts(count=1, user_id=2)
+        self.assertEqual(self.client.get(STATS_URL).get_json()["items"], 2)
+
+    @skipUnless(msgpack_codec.available(), "msgpack is not installed")
+    def test_msgpack(self):
+        """It should send the statistics as MessagePack"""
+        self._populate_shopcarts(count=2, user_id=1)
+        resp = self.client.get(
+            STATS_URL, headers={"Accept": msgpack_codec.MSGPACK_MIMETYPE}
+        )
+        self.assertEqual(resp.mimetype, msgpack_codec.MSGPACK_MIMETYPE)
+        self.assertEqual(
+            msgpack_codec.loads(resp.data), self.client.get(STATS_URL).get_json()
+        )